@@ -1,3 +1,4 @@
+from django.utils.functional import SimpleLazyObject
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import BasePermission
@@ -6,9 +7,10 @@ from .models import AuthToken
 
 class RequireAuthToken(BasePermission):
 	def has_permission(self, request, view):
-		if request.user and request.user.is_staff:
+		# Checked first as request.user may be loaded lazily
+		if hasattr(request, "auth_token"):
 			return True
-		return hasattr(request, "auth_token")
+		return bool(request.user and request.user.is_staff)
 
 
 class AuthTokenAuthentication(TokenAuthentication):
@@ -23,12 +25,15 @@ class AuthTokenAuthentication(TokenAuthentication):
 	def authenticate_credentials(self, key):
 		model = self.get_model()
 		try:
-			token = model.objects.get(key=key)
+			token, user_is_active = model.objects.get_cached(key)
 		except (model.DoesNotExist, ValueError):
 			raise AuthenticationFailed("Invalid token.")
 
-		if token.user:
-			if not token.user.is_active:
-				raise AuthenticationFailed("User cannot log in.")
+		if token.user_id is None:
+			return None, token
 
-		return token.user, token
+		if not user_is_active:
+			raise AuthenticationFailed("User cannot log in.")
+
+		# The user is only loaded if the view needs it
+		return SimpleLazyObject(lambda: token.user), token
@@ -1,6 +1,49 @@
 import uuid
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
+from django.dispatch import receiver
+
+
+class AuthTokenManager(models.Manager):
+	def get_cached(self, key):
+		"""
+		Returns a (token, user_is_active) tuple for an AuthToken key.
+		The token's user_id and the user's is_active flag are cached for
+		AUTH_CACHE_TTL seconds, the other fields of the token are deferred.
+
+		Raises DoesNotExist (or ValueError if the key is not a UUID).
+		"""
+		key = uuid.UUID(str(key))
+		cache_key = "api:auth_token:%s" % (key)
+		cached = cache.get(cache_key)
+		if cached is None:
+			token = self.select_related("user").get(key=key)
+			cached = (token.user_id, token.user.is_active if token.user else None)
+			cache.set(cache_key, cached, settings.AUTH_CACHE_TTL)
+
+		user_id, user_is_active = cached
+		token = self.model.from_db(self.db, ["key", "user_id"], [key, user_id])
+		return token, user_is_active
+
+
+class APIKeyManager(models.Manager):
+	def get_cached(self, api_key):
+		"""
+		Returns the APIKey for an api_key. Its id and enabled flag are
+		cached for AUTH_CACHE_TTL seconds, the other fields are deferred.
+
+		Raises DoesNotExist (or ValueError if the key is not a UUID).
+		"""
+		api_key = uuid.UUID(str(api_key))
+		cache_key = "api:api_key:%s" % (api_key)
+		cached = cache.get(cache_key)
+		if cached is None:
+			cached = self.values_list("id", "enabled").get(api_key=api_key)
+			cache.set(cache_key, cached, settings.AUTH_CACHE_TTL)
+
+		pk, enabled = cached
+		return self.model.from_db(self.db, ["id", "api_key", "enabled"], [pk, api_key, enabled])
 
 
 class AuthToken(models.Model):
@@ -11,6 +54,8 @@ class AuthToken(models.Model):
 	)
 	created = models.DateTimeField("Created", auto_now_add=True)
 
+	objects = AuthTokenManager()
+
 	def __str__(self):
 		return str(self.key)
 
@@ -29,6 +74,8 @@ class APIKey(models.Model):
 
 	tokens = models.ManyToManyField(AuthToken)
 
+	objects = APIKeyManager()
+
 	def __str__(self):
 		return self.full_name
 
@@ -36,3 +83,41 @@ class APIKey(models.Model):
 		if not self.api_key:
 			self.api_key = uuid.uuid4()
 		return super(APIKey, self).save(*args, **kwargs)
+
+
+@receiver(models.signals.post_save, sender=AuthToken)
+@receiver(models.signals.post_delete, sender=AuthToken)
+def invalidate_cached_auth_token(sender, instance, **kwargs):
+	cache.delete("api:auth_token:%s" % (instance.key))
+
+
+@receiver(models.signals.post_save, sender=APIKey)
+@receiver(models.signals.post_delete, sender=APIKey)
+def invalidate_cached_api_key(sender, instance, **kwargs):
+	cache.delete("api:api_key:%s" % (instance.api_key))
+
+
+@receiver(models.signals.post_init, sender=settings.AUTH_USER_MODEL)
+def track_user_is_active(sender, instance, **kwargs):
+	# Read from __dict__ so that a deferred is_active is not loaded
+	instance._initial_is_active = instance.__dict__.get("is_active")
+
+
+def invalidate_cached_user_tokens(instance):
+	keys = AuthToken.objects.filter(user=instance).values_list("key", flat=True)
+	cache.delete_many(["api:auth_token:%s" % (key) for key in keys])
+
+
+@receiver(models.signals.post_save, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens_on_save(sender, instance, created, update_fields, **kwargs):
+	# Only is_active is cached along with the tokens, and new users have none.
+	if created or (update_fields is not None and "is_active" not in update_fields):
+		return
+	if instance._initial_is_active is None or instance.is_active != instance._initial_is_active:
+		invalidate_cached_user_tokens(instance)
+	instance._initial_is_active = instance.is_active
+
+
+@receiver(models.signals.pre_delete, sender=settings.AUTH_USER_MODEL)
+def invalidate_cached_user_tokens_on_delete(sender, instance, **kwargs):
+	invalidate_cached_user_tokens(instance)
@@ -1,6 +1,154 @@
-from rest_framework.pagination import LimitOffsetPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, LimitOffsetPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class DefaultPagination(LimitOffsetPagination):
 	default_limit = 100
 	max_limit = 500
+
+
+class KeysetPagination(BasePagination):
+	"""
+	Cursor pagination on a compound key, such as ("-created", "-id").
+	The last field of the ordering must be unique.
+
+	Pages are looked up with a range filter on the key of the last (or
+	first) row of the current page instead of an offset, so deep pages
+	cost the same as the first one given an index on the ordering.
+	The cursor is an opaque base64 encoding of that key.
+	"""
+	ordering = ("-id", )
+	cursor_query_param = "cursor"
+	page_size_query_param = "limit"
+	page_size = 100
+	max_page_size = 500
+	invalid_cursor_message = "Invalid cursor"
+
+	def paginate_queryset(self, queryset, request, view=None):
+		self.request = request
+		page_size = self.get_page_size(request)
+		cursor = self.decode_cursor(request, queryset.model)
+		position, reverse = cursor if cursor else (None, False)
+
+		ordering = self.ordering
+		if reverse:
+			ordering = [f[1:] if f.startswith("-") else "-" + f for f in ordering]
+		queryset = queryset.order_by(*ordering)
+		if position is not None:
+			queryset = queryset.filter(self.get_position_filter(ordering, position))
+
+		results = list(queryset[:page_size + 1])
+		has_more = len(results) > page_size
+		self.page = results[:page_size]
+		if reverse:
+			self.page.reverse()
+			self.has_next, self.has_previous = True, has_more
+		else:
+			self.has_next, self.has_previous = has_more, position is not None
+
+		return self.page
+
+	def get_page_size(self, request):
+		try:
+			return _positive_int(
+				request.query_params[self.page_size_query_param],
+				strict=True,
+				cutoff=self.max_page_size
+			)
+		except (KeyError, ValueError):
+			return self.page_size
+
+	def get_position_filter(self, ordering, position):
+		"""
+		Returns a filter for the rows after `position` in `ordering`, eg.
+		`a < x OR (a = x AND id < y)` for the ordering ("-a", "-id").
+		"""
+		q, equal = Q(), {}
+		for field, value in zip(ordering, position):
+			name = field.lstrip("-")
+			lookup = "__lt" if field.startswith("-") else "__gt"
+			q |= Q(**dict(equal, **{name + lookup: value}))
+			equal[name] = value
+		return q
+
+	def get_ordering_fields(self, model):
+		"""
+		Returns the model fields of the ordering, following relations.
+		"""
+		fields = []
+		for name in self.ordering:
+			opts = model._meta
+			for attr in name.lstrip("-").split("__"):
+				field = opts.get_field(attr)
+				if field.is_relation:
+					opts = field.related_model._meta
+			fields.append(field)
+		return fields
+
+	def get_position(self, instance):
+		position = []
+		for field in self.ordering:
+			value = instance
+			for attr in field.lstrip("-").split("__"):
+				value = getattr(value, attr)
+			position.append(value.isoformat() if isinstance(value, datetime) else value)
+		return position
+
+	def decode_cursor(self, request, model):
+		encoded = request.query_params.get(self.cursor_query_param)
+		if not encoded:
+			return None
+		try:
+			data = json.loads(urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8"))
+			position, reverse = data["p"], bool(data.get("r"))
+			if not isinstance(position, list) or len(position) != len(self.ordering):
+				raise ValueError("Invalid position")
+			# Tampered values must not make it to the range filter
+			position = [
+				field.to_python(value)
+				for field, value in zip(self.get_ordering_fields(model), position)
+			]
+			if None in position:
+				raise ValueError("Invalid position")
+		except (TypeError, ValueError, KeyError, UnicodeError, ValidationError):
+			raise NotFound(self.invalid_cursor_message)
+		return position, reverse
+
+	def encode_cursor(self, position, reverse=False):
+		data = {"p": position}
+		if reverse:
+			data["r"] = 1
+		encoded = urlsafe_b64encode(json.dumps(data, separators=(",", ":")).encode("utf-8"))
+		url = self.request.build_absolute_uri()
+		return replace_query_param(url, self.cursor_query_param, encoded.decode("ascii"))
+
+	def get_next_link(self):
+		if not self.has_next or not self.page:
+			return None
+		return self.encode_cursor(self.get_position(self.page[-1]))
+
+	def get_previous_link(self):
+		if not self.has_previous:
+			return None
+		if not self.page:
+			return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+		return self.encode_cursor(self.get_position(self.page[0]), reverse=True)
+
+	def get_paginated_response(self, data):
+		return Response(OrderedDict([
+			("next", self.get_next_link()),
+			("previous", self.get_previous_link()),
+			("results", data),
+		]))
+
+
+class GameReplayPagination(KeysetPagination):
+	ordering = ("-global_game__match_start", "-id")
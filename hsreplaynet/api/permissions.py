@@ -16,14 +16,19 @@ class APIKeyPermission(permissions.BasePermission):
 		if not key:
 			return False
 
-		try:
-			api_key = APIKey.objects.get(api_key=key)
-		except (APIKey.DoesNotExist, ValueError):
+		api_key = self.get_api_key(key)
+		if api_key is None:
 			return False
 
 		request.api_key = api_key
 		return api_key.enabled
 
+	def get_api_key(self, key):
+		try:
+			return APIKey.objects.get_cached(key)
+		except (APIKey.DoesNotExist, ValueError):
+			return None
+
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
 	"""
@@ -1,12 +1,9 @@
 import json
-from django.core.files.storage import default_storage
 from django.core.serializers.json import DjangoJSONEncoder
-from django.utils.six import string_types
 from rest_framework import serializers
 from hsreplaynet.games.models import GameReplay, GlobalGame, GlobalGamePlayer
 from hsreplaynet.stats import models as stats_models
 from hsreplaynet.uploads.models import UploadEvent
-from hsreplaynet.utils import get_client_ip
 from .models import AuthToken, APIKey
 
 
@@ -14,18 +11,6 @@ class DeckListField(serializers.ListField):
 	child = serializers.CharField()
 
 
-class SmartFileField(serializers.FileField):
-	"""
-	A FileField which interprets a valid string as a file path.
-	Also see: serializers.FilePathField
-	"""
-	def to_internal_value(self, data):
-		if isinstance(data, string_types):
-			if default_storage.exists(data):
-				return default_storage.open(data, mode="rb")
-		return super(SmartFileField, self).to_internal_value(data)
-
-
 class AccountClaimSerializer(serializers.Serializer):
 	url = serializers.ReadOnlyField(source="get_absolute_url")
 
@@ -123,7 +108,7 @@ class UploadEventSerializer(serializers.Serializer):
 	game = GameSerializer(read_only=True)
 	stats = SnapshotStatsSerializer(required=False)
 
-	file = SmartFileField(write_only=True)
+	file = serializers.FileField(write_only=True)
 	game_type = serializers.IntegerField(default=0, write_only=True)
 	format = serializers.IntegerField(required=False, write_only=True)
 	build = serializers.IntegerField(write_only=True)
@@ -147,15 +132,20 @@ class UploadEventSerializer(serializers.Serializer):
 	player1 = PlayerSerializer(required=False, write_only=True)
 	player2 = PlayerSerializer(required=False, write_only=True)
 
-	def create(self, data):
-		request = self.context["request"]
+	def __init__(self, *args, **kwargs):
+		super(UploadEventSerializer, self).__init__(*args, **kwargs)
+		if self.context.get("file_key"):
+			# The file is already in storage (see create_upload_event)
+			self.fields.pop("file")
 
+	def create(self, data):
+		# See hsreplaynet.uploads.processing.create_upload_event
 		ret = UploadEvent(
-			file=data.pop("file"),
-			token=request.auth_token,
-			api_key=request.api_key,
+			file=self.context.get("file_key") or data.pop("file"),
+			token=self.context["token"],
+			api_key=self.context["api_key"],
 			type=data.pop("type"),
-			upload_ip=get_client_ip(request),
+			upload_ip=self.context["upload_ip"],
 		)
 		if "shortid" in data:
 			ret.shortid = data["shortid"]
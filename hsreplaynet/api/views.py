@@ -8,9 +8,12 @@ from rest_framework.status import HTTP_201_CREATED
 from hsreplaynet.accounts.models import AccountClaim
 from hsreplaynet.games.models import GameReplay
 from hsreplaynet.uploads.models import UploadEvent
+from hsreplaynet.uploads.processing import create_upload_event
+from hsreplaynet.utils import get_client_ip
 from . import serializers
 from .authentication import AuthTokenAuthentication, RequireAuthToken
 from .models import AuthToken, APIKey
+from .pagination import GameReplayPagination
 from .permissions import APIKeyPermission, IsOwnerOrReadOnly
 
 
@@ -50,6 +53,17 @@ class UploadEventViewSet(WriteOnlyOnceViewSet):
 	queryset = UploadEvent.objects.all()
 	serializer_class = serializers.UploadEventSerializer
 
+	def create(self, request):
+		upload_event = create_upload_event(
+			request.data,
+			token=getattr(request, "auth_token", None),
+			api_key=request.api_key,
+			upload_ip=get_client_ip(request),
+		)
+		serializer = self.get_serializer(upload_event)
+		headers = self.get_success_headers(serializer.data)
+		return Response(serializer.data, status=HTTP_201_CREATED, headers=headers)
+
 
 class GameReplayDetail(RetrieveDestroyAPIView):
 	queryset = GameReplay.objects.live()
@@ -65,6 +79,7 @@ class GameReplayDetail(RetrieveDestroyAPIView):
 class GameReplayList(ListAPIView):
 	queryset = GameReplay.objects.live().prefetch_related("user", "global_game__players")
 	serializer_class = serializers.GameReplayListSerializer
+	pagination_class = GameReplayPagination
 
 	def check_permissions(self, request):
 		if not request.user.is_authenticated:
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 from hearthstone import cardxml
-from ...models import Card
+from ...models import Card, CardCatalogVersion
 
 
 class Command(BaseCommand):
@@ -21,3 +21,9 @@ class Command(BaseCommand):
 		new_cards = [Card.from_cardxml(db[id]) for id in missing]
 		Card.objects.bulk_create(new_cards)
 		self.stdout.write("%i new cards" % (len(new_cards)))
+
+		if new_cards:
+			# Let in-process card caches know they are out of date
+			version = CardCatalogVersion.objects.create(num_cards=len(known_ids) + len(new_cards))
+			Card.objects.invalidate_cache()
+			self.stdout.write("Card catalog version is now %i" % (version.id))
@@ -1,11 +1,19 @@
 import hashlib
 import random
-from django.db import models
+import time
+from collections import Counter, namedtuple
+from django.db import IntegrityError, models, transaction
 from hearthstone import enums
 from hsreplaynet.utils.fields import IntEnumField
 
 
+CachedCard = namedtuple("CachedCard", ("type", "card_class", "collectible"))
+
+
 class CardManager(models.Manager):
+	# How often (in seconds) the card cache checks whether load_cards has run
+	CACHE_VERSION_CHECK_INTERVAL = 300
+
 	def random(self, cost=None, collectible=True, card_class=None):
 		"""
 		Return a random Card.
@@ -33,6 +41,50 @@ class CardManager(models.Manager):
 
 		return self._usable_cards
 
+	def get_cached(self, id):
+		"""
+		Return a CachedCard (type, card_class, collectible) for the card
+		with the given id, or None if no such card exists.
+
+		The card catalog is loaded once per process and reloaded when
+		load_cards has bumped the CardCatalogVersion since.
+		"""
+		cache_time = getattr(self, "_card_cache_time", None)
+		if cache_time is None or time.time() - cache_time > self.CACHE_VERSION_CHECK_INTERVAL:
+			version = CardCatalogVersion.objects.current()
+			if getattr(self, "_card_cache", None) is None or version != self._card_cache_version:
+				self._card_cache = self._load_card_cache()
+				self._card_cache_version = version
+			self._card_cache_time = time.time()
+
+		return self._card_cache.get(id)
+
+	def _load_card_cache(self):
+		cards = Card.objects.values_list("id", "type", "card_class", "collectible")
+		return {c[0]: CachedCard(*c[1:]) for c in cards}
+
+	def invalidate_cache(self):
+		self._card_cache = None
+		self._card_cache_time = None
+
+
+class CardCatalogVersionManager(models.Manager):
+	def current(self):
+		return self.order_by("-id").values_list("id", flat=True).first()
+
+
+class CardCatalogVersion(models.Model):
+	"""
+	A version stamp for the card catalog, bumped by load_cards.
+	Used to invalidate in-process card caches (see CardManager.get_cached).
+	"""
+	objects = CardCatalogVersionManager()
+	created = models.DateTimeField(auto_now_add=True)
+	num_cards = models.PositiveIntegerField()
+
+	def __str__(self):
+		return "Card catalog #%i (%i cards)" % (self.id, self.num_cards)
+
 
 class Card(models.Model):
 	id = models.CharField(primary_key=True, max_length=50)
@@ -117,22 +169,21 @@ class DeckManager(models.Manager):
 		if existing_deck:
 			return (existing_deck, False)
 
-		deck = Deck.objects.create(digest=digest)
-
-		for card_id in id_list:
-			include, created = deck.include_set.get_or_create(
-				deck=deck,
-				card_id=card_id,
-				defaults={"count": 1}
-			)
-
-			if not created:
-				# This must be an additional copy of a card we've
-				# seen previously so we increment the count
-				include.count += 1
-				include.save()
+		try:
+			with transaction.atomic():
+				deck = Deck.objects.create(digest=digest)
+				counts = Counter(id_list)
+				Include.objects.bulk_create([
+					Include(deck=deck, card_id=card_id, count=count)
+					for card_id, count in counts.items()
+				])
+		except IntegrityError:
+			# The same deck may have been created concurrently by another upload
+			existing_deck = Deck.objects.filter(digest=digest).first()
+			if existing_deck is None:
+				raise
+			return (existing_deck, False)
 
-		deck.save()
 		return (deck, True)
 
 
@@ -170,7 +221,10 @@ class Deck(models.Model):
 
 	def save(self, *args, **kwargs):
 		EMPTY_DECK_DIGEST = 'd41d8cd98f00b204e9800998ecf8427e'
-		if self.digest != EMPTY_DECK_DIGEST and self.include_set.count() == 0:
+		if self.pk is None:
+			# A new deck has no includes yet, so there is nothing to recalculate.
+			return super(Deck, self).save(*args, **kwargs)
+		elif self.digest != EMPTY_DECK_DIGEST and self.include_set.count() == 0:
 			# A client has set a digest by hand, so don't recalculate it.
 			return super(Deck, self).save(*args, **kwargs)
 		else:
@@ -182,7 +236,7 @@ class Deck(models.Model):
 
 		for i in self.include_set.all():
 			for n in range(0, i.count):
-				result.append(i.card.id)
+				result.append(i.card_id)
 
 		return result
 
@@ -4,6 +4,7 @@ from hsreplaynet.uploads.models import UploadEvent
 from hsreplaynet.uploads.processing import queue_upload_event_for_processing
 from hsreplaynet.utils.admin import admin_urlify as urlify, set_user
 from .models import GameReplay, GlobalGame, GlobalGamePlayer, PendingReplayOwnership
+from .reprocessing import reprocess_queryset
 
 
 def queue_for_reprocessing(admin, request, queryset):
@@ -14,6 +15,16 @@ def queue_for_reprocessing(admin, request, queryset):
 queue_for_reprocessing.short_description = "Queue original upload for reprocessing"
 
 
+def reprocess_from_xml(admin, request, queryset):
+	done, changed, failed = 0, 0, 0
+	for done, changed, failed in reprocess_queryset(queryset):
+		pass
+	admin.message_user(request, "%i replays reprocessed, %i changed, %i failed" % (
+		done, changed, failed
+	))
+reprocess_from_xml.short_description = "Recompute derived data from the replay XML"
+
+
 class GlobalGamePlayerInline(admin.StackedInline):
 	model = GlobalGamePlayer
 	raw_id_fields = ("user", "hero", "deck_list")
@@ -42,7 +53,7 @@ class PendingReplayOwnershipInline(admin.TabularInline):
 
 @admin.register(GameReplay)
 class GameReplayAdmin(admin.ModelAdmin):
-	actions = (set_user, queue_for_reprocessing)
+	actions = (set_user, queue_for_reprocessing, reprocess_from_xml)
 	list_display = (
 		"__str__", urlify("user"), urlify("global_game"), "visibility",
 		"build", "client_handle", "hsreplay_version", "replay_xml",
@@ -0,0 +1,223 @@
+"""
+Offline benchmark of the upload processing pipeline.
+
+Runs do_process_upload_event() end to end against the configured database
+and storage (sqlite3 and FileSystemStorage by default) for a set of logs,
+and reports throughput, latency percentiles, query counts and peak memory
+for every processing phase.
+
+Every iteration commits for real, so that the db_commit phase and its
+on_commit work are measured too. The rows it created are deleted again
+afterwards; rows it only updated (eg. win rate rollups) are not reverted.
+Peak memory is measured in a separate pass, as tracing allocations slows
+down processing considerably.
+
+The example logs from the hsreplay-test-data repository are used by default
+(see scripts/update_log_data.sh). Results can be saved as a JSON baseline
+and later runs compared against it to catch regressions before deploying:
+
+$ ./manage.py benchmark_processing --save-baseline benchmark.json
+$ ./manage.py benchmark_processing --baseline benchmark.json
+"""
+import json
+import os
+import tracemalloc
+import shortuuid
+from django.apps import apps
+from django.conf import settings
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers import sort_dependencies
+from django.db import models
+from django.utils.timezone import now
+from hsreplaynet.uploads.models import UploadEvent, UploadEventType
+from hsreplaynet.utils.instrumentation import InfluxProfile
+from ...processing import do_process_upload_event
+
+
+DATA_DIR = os.path.join(settings.BASE_DIR, "data", "hsreplay-test-data", "examples")
+DEFAULT_LOGS = [
+	os.path.join(DATA_DIR, "short.log"),  # 4 minute game
+	os.path.join(DATA_DIR, "medium.log"),  # 9 minute game
+	os.path.join(DATA_DIR, "large.log"),  # 31 minute game
+]
+
+# Metrics compared against the baseline. Higher is worse for all of them.
+COMPARED_METRICS = ("p50_ms", "p99_ms", "queries", "peak_memory")
+
+
+def percentile(values, pct):
+	values = sorted(values)
+	index = int(round((len(values) - 1) * pct / 100))
+	return values[index]
+
+
+class Command(BaseCommand):
+	help = "Benchmark the upload processing pipeline on local logs."
+
+	def add_arguments(self, parser):
+		parser.add_argument("logs", nargs="*", help="Power.log files to process")
+		parser.add_argument("-n", "--iterations", type=int, default=5)
+		parser.add_argument("--baseline", help="JSON baseline to compare results against")
+		parser.add_argument("--save-baseline", help="Save the results as a JSON baseline")
+		parser.add_argument(
+			"--tolerance", type=float, default=0.2,
+			help="Relative increase over the baseline reported as a regression"
+		)
+
+	def handle(self, *args, **options):
+		logs = options["logs"] or DEFAULT_LOGS
+		for path in logs:
+			if not os.path.exists(path):
+				raise CommandError("%r does not exist. Run scripts/update_log_data.sh?" % (path))
+
+		results = {
+			os.path.basename(path): self.benchmark_log(path, options["iterations"])
+			for path in logs
+		}
+
+		for name, result in sorted(results.items()):
+			self.print_result(name, result)
+
+		if options["save_baseline"]:
+			with open(options["save_baseline"], "w") as f:
+				json.dump(results, f, sort_keys=True, indent="\t")
+			self.stdout.write("Saved baseline to %r" % (options["save_baseline"]))
+
+		if options["baseline"]:
+			with open(options["baseline"], "r") as f:
+				baseline = json.load(f)
+			regressions = self.compare(results, baseline, options["tolerance"])
+			if regressions:
+				for regression in regressions:
+					self.stderr.write(regression)
+				raise CommandError("%i regressions against %r" % (len(regressions), options["baseline"]))
+			self.stdout.write("No regressions against %r" % (options["baseline"]))
+
+	def benchmark_log(self, path, iterations):
+		self.stdout.write("Benchmarking %r (%i iterations)" % (path, iterations))
+		profiles = []
+		for i in range(iterations):
+			profiles.append(self.process_log(path))
+
+		tracemalloc.start()
+		try:
+			memory_profile = self.process_log(path)
+		finally:
+			tracemalloc.stop()
+
+		num_bytes = os.path.getsize(path)
+		durations = [p["value"] for p in profiles]
+		total_seconds = sum(durations) / 1000
+
+		phases = {}
+		for key in profiles[0]:
+			if key.endswith("_ms") and key != "cpu_ms" and not key.endswith("_cpu_ms"):
+				phase = key[:-len("_ms")]
+				phases[phase] = {
+					"p50_ms": percentile([p[key] for p in profiles], 50),
+					"queries": max(p.get(phase + "_queries", 0) for p in profiles),
+					"peak_memory": memory_profile.get(phase + "_peak_memory", 0),
+				}
+
+		return {
+			"bytes": num_bytes,
+			"iterations": iterations,
+			"uploads_per_second": iterations / total_seconds,
+			"bytes_per_second": num_bytes * iterations / total_seconds,
+			"p50_ms": percentile(durations, 50),
+			"p99_ms": percentile(durations, 99),
+			"queries": max(p["queries"] for p in profiles),
+			"peak_memory": memory_profile.get("peak_memory", 0),
+			"phases": phases,
+		}
+
+	def process_log(self, path):
+		"""
+		Process a log once and return the profile fields.
+		Created rows and stored files are deleted afterwards.
+		"""
+		metadata = {
+			"build": 0,
+			"match_start": now().isoformat(),
+		}
+		event = UploadEvent(
+			type=UploadEventType.POWER_LOG,
+			upload_ip="127.0.0.1",
+			metadata=json.dumps(metadata),
+		)
+		# The upload path is built from the shortid, which is only set on save
+		event.shortid = shortuuid.uuid()
+		replay = None
+		profile = InfluxProfile("benchmark_processing", count_queries=True)
+		last_ids = self.get_last_ids()
+
+		try:
+			with open(path, "rb") as f:
+				event.file.save(os.path.basename(path), File(f), save=False)
+			event.save()
+
+			with profile:
+				replay = do_process_upload_event(event)
+		finally:
+			if event.file.name:
+				event.file.delete(save=False)
+			if replay is not None and replay.replay_xml.name:
+				replay.replay_xml.delete(save=False)
+			self.delete_created_rows(last_ids)
+
+		return profile.fields
+
+	def get_cleanup_models(self):
+		"""
+		Models with an auto-incrementing primary key, ordered so that
+		referring models come before the models they refer to.
+		"""
+		ordered = sort_dependencies([(app, None) for app in apps.get_app_configs()])
+		return [
+			model for model in reversed(ordered)
+			if model._meta.managed and not model._meta.proxy and
+			isinstance(model._meta.pk, models.AutoField)
+		]
+
+	def get_last_ids(self):
+		return [
+			(model, model.objects.aggregate(last_id=models.Max("pk"))["last_id"] or 0)
+			for model in self.get_cleanup_models()
+		]
+
+	def delete_created_rows(self, last_ids):
+		for model, last_id in last_ids:
+			model.objects.filter(pk__gt=last_id).delete()
+
+	def print_result(self, name, result):
+		self.stdout.write("\n%s (%i bytes)" % (name, result["bytes"]))
+		self.stdout.write("  Throughput: %.2f uploads/s, %.0f KB/s" % (
+			result["uploads_per_second"], result["bytes_per_second"] / 1024
+		))
+		self.stdout.write("  Latency: p50 %.1f ms, p99 %.1f ms" % (result["p50_ms"], result["p99_ms"]))
+		self.stdout.write("  Queries: %i, peak memory: %i KB" % (
+			result["queries"], result["peak_memory"] / 1024
+		))
+		for phase, stats in sorted(result["phases"].items()):
+			self.stdout.write("    %-15s p50 %8.1f ms %5i queries %8i KB" % (
+				phase, stats["p50_ms"], stats["queries"], stats["peak_memory"] / 1024
+			))
+
+	def compare(self, results, baseline, tolerance):
+		regressions = []
+
+		def check(label, current, previous):
+			for metric in COMPARED_METRICS:
+				old, new = previous.get(metric), current.get(metric)
+				if old and new is not None and new > old * (1 + tolerance):
+					regressions.append("%s: %s went from %r to %r" % (label, metric, old, new))
+
+		for name, result in sorted(results.items()):
+			if name not in baseline:
+				continue
+			check(name, result, baseline[name])
+			for phase, stats in sorted(result["phases"].items()):
+				check("%s [%s]" % (name, phase), stats, baseline[name]["phases"].get(phase, {}))
+
+		return regressions
@@ -0,0 +1,137 @@
+"""
+Bulk ingestion of local Power.log files, eg. to seed a staging database
+or to re-import an archive of historical logs.
+
+Logs are processed across a pool of worker processes, each with its own
+database connection. Files whose content was already ingested successfully
+(see UploadEvent.file_hash) are skipped.
+
+$ ./manage.py bulk_ingest_logs --processes 8 /archive/2016/ "/archive/misc/*.log"
+"""
+import json
+import os
+from collections import Counter
+from datetime import datetime
+from fnmatch import fnmatch
+from glob import glob
+from multiprocessing import Pool, cpu_count
+import shortuuid
+from django.core.files import File
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.utils.timezone import utc
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+from hsreplaynet.utils import get_file_hash, perf_counter
+
+
+# Number of files between two progress reports
+PROGRESS_INTERVAL = 100
+
+
+def find_logs(paths, pattern):
+	"""
+	Yields the files matching the given files, directories or globs.
+	Directories are walked recursively for files matching `pattern`.
+	"""
+	for path in paths:
+		for match in sorted(glob(path)) or [path]:
+			if os.path.isdir(match):
+				for root, dirs, files in os.walk(match):
+					dirs.sort()
+					for name in sorted(files):
+						if fnmatch(name, pattern):
+							yield os.path.join(root, name)
+			else:
+				yield match
+
+
+def ingest_log(args):
+	"""
+	Creates and processes an UploadEvent for a log file, unless a file
+	with the same content was already ingested successfully.
+	Returns (path, status, file size, error message).
+	"""
+	path, force = args
+	try:
+		with open(path, "rb") as f:
+			file_hash = get_file_hash(f)
+			num_bytes = f.tell()
+
+			if not force and UploadEvent.objects.filter(
+				file_hash=file_hash, status=UploadEventStatus.SUCCESS
+			).exists():
+				return path, "skipped", num_bytes, None
+
+			# Historical logs are dated by their modification time
+			match_start = datetime.fromtimestamp(os.path.getmtime(path), utc)
+			event = UploadEvent(
+				type=UploadEventType.POWER_LOG,
+				upload_ip="127.0.0.1",
+				metadata=json.dumps({"build": 0, "match_start": match_start.isoformat()}),
+				file_hash=file_hash,
+			)
+			# The upload path is built from the shortid, which is only set on save
+			event.shortid = shortuuid.uuid()
+			f.seek(0)
+			event.file.save(os.path.basename(path), File(f), save=False)
+		event.save()
+		event.process()
+	except Exception as e:
+		return path, "failed", 0, "%s: %s" % (e.__class__.__name__, e)
+
+	return path, "ingested", num_bytes, None
+
+
+class Command(BaseCommand):
+	help = "Ingest local Power.log files in bulk across a process pool."
+
+	def add_arguments(self, parser):
+		parser.add_argument("paths", nargs="+", help="Log files, directories or globs")
+		parser.add_argument(
+			"--pattern", default="*.log",
+			help="Filename pattern of the logs in directories (default: %(default)s)"
+		)
+		parser.add_argument("-p", "--processes", type=int, default=cpu_count())
+		parser.add_argument(
+			"--force", action="store_true",
+			help="Ingest files even if their content was already ingested"
+		)
+
+	def handle(self, *args, **options):
+		paths = list(find_logs(options["paths"], options["pattern"]))
+		if not paths:
+			raise CommandError("No logs found.")
+		self.stdout.write("Ingesting %i logs with %i processes" % (len(paths), options["processes"]))
+
+		# Forked workers must not share the parent's database connections
+		connections.close_all()
+		pool = Pool(options["processes"], initializer=connections.close_all)
+		statuses, errors = Counter(), Counter()
+		num_bytes, start = 0, perf_counter()
+
+		try:
+			tasks = [(path, options["force"]) for path in paths]
+			for i, (path, status, size, error) in enumerate(pool.imap_unordered(ingest_log, tasks)):
+				statuses[status] += 1
+				if status == "ingested":
+					num_bytes += size
+				if error:
+					errors[error] += 1
+					self.stderr.write("%s: %s" % (path, error))
+				if (i + 1) % PROGRESS_INTERVAL == 0:
+					self.stdout.write("%i/%i logs done" % (i + 1, len(paths)))
+		finally:
+			pool.terminate()
+			pool.join()
+
+		elapsed = perf_counter() - start
+		self.stdout.write("\n%i ingested, %i skipped, %i failed in %.1f seconds" % (
+			statuses["ingested"], statuses["skipped"], statuses["failed"], elapsed
+		))
+		self.stdout.write("Throughput: %.2f logs/s, %.0f KB/s of ingested logs" % (
+			statuses["ingested"] / elapsed, num_bytes / 1024 / elapsed
+		))
+		if errors:
+			self.stdout.write("Most common errors:")
+			for error, count in errors.most_common(10):
+				self.stdout.write("%6i  %s" % (count, error))
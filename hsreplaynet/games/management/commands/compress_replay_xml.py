@@ -0,0 +1,55 @@
+from gzip import GzipFile
+from io import BytesIO
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from hsreplaynet.utils.aws import S3
+from ...models import GameReplay
+
+
+def gzip_bytes(data):
+	buf = BytesIO()
+	with GzipFile(mode="wb", compresslevel=9, fileobj=buf) as f:
+		f.write(data)
+	return buf.getvalue()
+
+
+class Command(BaseCommand):
+	help = "Recompress replay XML files stored in S3 without a gzip Content-Encoding."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--dry-run", action="store_true", help="Only report what would be done")
+		parser.add_argument("--since", type=int, default=0, help="Only check replays from this ID on")
+
+	def handle(self, *args, **options):
+		if S3 is None or not getattr(settings, "AWS_IS_GZIPPED", False):
+			raise CommandError("Replay XML is not stored in gzipped S3 storage (see AWS_IS_GZIPPED).")
+
+		bucket = settings.AWS_STORAGE_BUCKET_NAME
+		replays = GameReplay.objects.filter(id__gte=options["since"]).exclude(replay_xml="")
+		replays = replays.order_by("id").values_list("id", "replay_xml")
+
+		total, bytes_before, bytes_after = 0, 0, 0
+		for replay_id, key in replays.iterator():
+			head = S3.head_object(Bucket=bucket, Key=key)
+			if head.get("ContentEncoding") == "gzip":
+				continue
+
+			data = S3.get_object(Bucket=bucket, Key=key)["Body"].read()
+			compressed = gzip_bytes(data)
+			total += 1
+			bytes_before += len(data)
+			bytes_after += len(compressed)
+			self.stdout.write("%i: %s (%i -> %i bytes)" % (replay_id, key, len(data), len(compressed)))
+			if options["dry_run"]:
+				continue
+
+			S3.put_object(
+				Bucket=bucket,
+				Key=key,
+				Body=compressed,
+				ACL=settings.AWS_DEFAULT_ACL,
+				ContentType="application/xml",
+				ContentEncoding="gzip",
+			)
+
+		self.stdout.write("Compressed %i replays (%i -> %i bytes)" % (total, bytes_before, bytes_after))
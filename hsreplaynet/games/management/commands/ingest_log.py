@@ -1,4 +1,6 @@
 import json
+import os
+import shortuuid
 from django.core.files import File
 from django.core.management.base import BaseCommand
 from django.utils.timezone import now
@@ -22,13 +24,12 @@ class Command(BaseCommand):
 				upload_ip="127.0.0.1",
 				metadata=json.dumps(metadata),
 			)
+			# The upload path is built from the shortid, which is only set on save
+			event.shortid = shortuuid.uuid()
 
-			event.file = file
+			with open(file, "rb") as f:
+				event.file.save(os.path.basename(file), File(f), save=False)
 			event.save()
 
-			with open(file, "r") as f:
-				event.file = File(f)
-				event.save()
-
 			event.process()
 			self.stdout.write("%r: %s" % (event, event.get_absolute_url()))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from ...models import GameReplay
+from ...reprocessing import REPROCESSABLE_FIELDS, reprocess_queryset
+
+
+class Command(BaseCommand):
+	help = "Recompute derived game data from the stored replay XML."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--fields", nargs="+", choices=REPROCESSABLE_FIELDS, default=REPROCESSABLE_FIELDS,
+			help="Derived data to recompute"
+		)
+		parser.add_argument("--since", type=int, default=0, help="Only reprocess replays from this ID on")
+		parser.add_argument("--until", type=int, help="Only reprocess replays up to this ID")
+		parser.add_argument("-p", "--processes", type=int, default=1)
+		parser.add_argument("--chunk-size", type=int, default=100)
+
+	def handle(self, *args, **options):
+		replays = GameReplay.objects.filter(id__gte=options["since"]).exclude(replay_xml="")
+		if options["until"] is not None:
+			replays = replays.filter(id__lte=options["until"])
+
+		done, changed, failed = 0, 0, 0
+		for done, changed, failed in reprocess_queryset(
+			replays, options["fields"], options["processes"], options["chunk_size"]
+		):
+			self.stdout.write("%i replays reprocessed, %i changed, %i failed" % (done, changed, failed))
+
+		self.stdout.write("Done: %i replays reprocessed, %i changed, %i failed" % (done, changed, failed))
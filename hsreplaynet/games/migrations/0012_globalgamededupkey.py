@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:19
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0011_auto_20160728_2036'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GlobalGameDedupKey',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('server_address', models.GenericIPAddressField(blank=True, null=True)),
+                ('server_port', models.IntegerField(blank=True, null=True)),
+                ('game_handle', models.IntegerField()),
+                ('build', models.PositiveIntegerField(blank=True, null=True)),
+                ('time_bucket', models.IntegerField(help_text='Deduplication time bucket of the match start.')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='globalgamededupkey',
+            name='global_game',
+            field=models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='dedup_key', to='games.GlobalGame'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='globalgamededupkey',
+            unique_together=set([('server_address', 'server_port', 'game_handle', 'build', 'time_bucket')]),
+        ),
+    ]
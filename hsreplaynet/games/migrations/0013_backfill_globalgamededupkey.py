@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:20
+from __future__ import unicode_literals
+
+from django.db import migrations
+from hsreplaynet.utils import deduplication_time_bucket
+
+
+def backfill_dedup_keys(apps, schema_editor):
+    GlobalGame = apps.get_model("games", "GlobalGame")
+    GlobalGameDedupKey = apps.get_model("games", "GlobalGameDedupKey")
+
+    seen = set()
+    batch = []
+    games = GlobalGame.objects.exclude(game_handle=None).order_by("id").values_list(
+        "id", "server_address", "server_port", "game_handle", "build", "match_start"
+    )
+    for id, server_address, server_port, game_handle, build, match_start in games.iterator():
+        key = (server_address, server_port, game_handle, build, deduplication_time_bucket(match_start))
+        if key in seen:
+            # Games which were already duplicated keep pointing to the oldest one
+            continue
+        seen.add(key)
+        batch.append(GlobalGameDedupKey(
+            global_game_id=id,
+            server_address=server_address,
+            server_port=server_port,
+            game_handle=game_handle,
+            build=build,
+            time_bucket=key[-1],
+        ))
+        if len(batch) >= 5000:
+            GlobalGameDedupKey.objects.bulk_create(batch)
+            batch = []
+
+    GlobalGameDedupKey.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0012_globalgamededupkey'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_dedup_keys, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0013_backfill_globalgamededupkey'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='globalgame',
+            name='match_start',
+            field=models.DateTimeField(db_index=True, help_text='Must be a timezone aware datetime.', verbose_name='Match start'),
+        ),
+    ]
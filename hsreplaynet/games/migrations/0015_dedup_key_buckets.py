@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 14:02
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+NULL_SERVER_ADDRESS = "0.0.0.0"
+
+
+def replace_null_key_fields(apps, schema_editor):
+    GlobalGameDedupKey = apps.get_model("games", "GlobalGameDedupKey")
+
+    keys = GlobalGameDedupKey.objects.filter(
+        models.Q(server_address=None) | models.Q(server_port=None) | models.Q(build=None)
+    ).order_by("id")
+    for key in keys.iterator():
+        key.server_address = key.server_address or NULL_SERVER_ADDRESS
+        key.server_port = key.server_port or 0
+        key.build = key.build or 0
+        duplicates = GlobalGameDedupKey.objects.filter(
+            server_address=key.server_address,
+            server_port=key.server_port,
+            game_handle=key.game_handle,
+            build=key.build,
+            time_bucket=key.time_bucket,
+        )
+        if duplicates.exists():
+            # NULLs never conflicted: keep the key of the oldest game
+            key.delete()
+        else:
+            key.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0014_globalgame_match_start_index'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='globalgamededupkey',
+            name='global_game',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dedup_keys', to='games.GlobalGame'),
+        ),
+        migrations.RunPython(replace_null_key_fields, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='globalgamededupkey',
+            name='server_address',
+            field=models.GenericIPAddressField(),
+        ),
+        migrations.AlterField(
+            model_name='globalgamededupkey',
+            name='server_port',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='globalgamededupkey',
+            name='build',
+            field=models.PositiveIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='globalgamededupkey',
+            name='time_bucket',
+            field=models.IntegerField(help_text='Deduplication time bucket covered by the match start range.'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 12:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_complete_deck_lists(apps, schema_editor):
+    Deck = apps.get_model("cards", "Deck")
+    GlobalGamePlayer = apps.get_model("games", "GlobalGamePlayer")
+
+    # Whether a deck list was uploaded is not known for past games
+    complete_decks = Deck.objects.annotate(
+        size=models.Sum("include__count")
+    ).filter(size__gte=30).values("id")
+    GlobalGamePlayer.objects.filter(deck_list__in=complete_decks).update(deck_list_complete=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0005_cardcatalogversion'),
+        ('games', '0015_dedup_key_buckets'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='globalgameplayer',
+            name='deck_list_complete',
+            field=models.BooleanField(default=False, help_text='Whether the deck list was uploaded or all of its cards are known.', verbose_name='Deck list complete'),
+        ),
+        migrations.RunPython(mark_complete_deck_lists, migrations.RunPython.noop),
+    ]
@@ -11,6 +11,7 @@ from hearthstone.enums import BnetGameType, FormatType, PlayState
 from hsreplaynet.api.models import AuthToken
 from hsreplaynet.cards.models import Card, Deck
 from hsreplaynet.utils.fields import IntEnumField, PlayerIDField, ShortUUIDField
+from hsreplaynet.utils.instrumentation import influx_phase, record_io
 
 
 def _generate_upload_path(instance, filename):
@@ -62,7 +63,8 @@ class GlobalGame(models.Model):
 	)
 
 	match_start = models.DateTimeField(
-		"Match start", help_text="Must be a timezone aware datetime."
+		"Match start", db_index=True,
+		help_text="Must be a timezone aware datetime."
 	)
 
 	match_end = models.DateTimeField(
@@ -118,6 +120,61 @@ class GlobalGame(models.Model):
 		return ceil(self.num_turns / 2)
 
 
+class GlobalGameDedupKey(models.Model):
+	"""
+	Identifies a GlobalGame by its Battle.net server metadata.
+
+	Uploads carrying enough metadata to be deduplicated look up their
+	GlobalGame through this table with a single indexed query, and the
+	unique constraint makes concurrent uploads of both sides of a game
+	resolve to the same GlobalGame.
+	The time bucket (see utils.deduplication_time_bucket) stands in for the
+	match start range, as game handles are reused over time.
+
+	A game holds a key for every bucket its deduplication range overlaps
+	(see utils.deduplication_time_buckets), so that concurrent uploads
+	whose match starts fall on both sides of a bucket boundary still
+	conflict on a shared key. Missing server fields and builds are stored
+	as sentinels (see get_key_fields), as NULLs never conflict.
+	"""
+	NULL_SERVER_ADDRESS = "0.0.0.0"
+
+	id = models.BigAutoField(primary_key=True)
+	global_game = models.ForeignKey(
+		GlobalGame, on_delete=models.CASCADE, related_name="dedup_keys"
+	)
+	server_address = models.GenericIPAddressField()
+	server_port = models.IntegerField()
+	game_handle = models.IntegerField()
+	build = models.PositiveIntegerField()
+	time_bucket = models.IntegerField(
+		help_text="Deduplication time bucket covered by the match start range."
+	)
+
+	class Meta:
+		unique_together = (
+			"server_address", "server_port", "game_handle", "build", "time_bucket"
+		)
+
+	def __str__(self):
+		return "%s:%s #%s (build %s, bucket %s)" % (
+			self.server_address, self.server_port, self.game_handle,
+			self.build, self.time_bucket
+		)
+
+	@classmethod
+	def get_key_fields(cls, server_address, server_port, game_handle, build):
+		"""
+		Returns the fields of the key of a game, minus its time bucket.
+		"""
+		return {
+			"server_address": server_address or cls.NULL_SERVER_ADDRESS,
+			"server_port": server_port or 0,
+			"game_handle": game_handle,
+			"build": build or 0,
+		}
+
+
 class GlobalGamePlayer(models.Model):
 	id = models.BigAutoField(primary_key=True)
 	game = models.ForeignKey(GlobalGame, on_delete=models.CASCADE, related_name="players")
@@ -159,6 +216,10 @@ class GlobalGamePlayer(models.Model):
 		Deck, on_delete=models.PROTECT,
 		help_text="As much as is known of the player's starting deck list."
 	)
+	deck_list_complete = models.BooleanField("Deck list complete",
+		default=False,
+		help_text="Whether the deck list was uploaded or all of its cards are known.",
+	)
 
 	# Game type metadata
 
@@ -311,13 +372,17 @@ class GameReplay(models.Model):
 	def get_absolute_url(self):
 		return reverse("games_replay_view", kwargs={"id": self.shortid})
 
-	def update_final_states(self):
+	def update_final_states(self, player=None):
 		"""
 		Updates the replay's `won` and `disconnected` attributes
 		based on the final_state of its players.
+
+		The friendly player is looked up unless it is passed in.
 		"""
+		if player is None:
+			player = self.global_game.players.get(player_id=self.friendly_player_id)
+
 		# Record whether the user won/lost the game
-		player = self.global_game.players.get(player_id=self.friendly_player_id)
 		if player.final_state in (PlayState.PLAYING, PlayState.INVALID):
 			# This means we disconnected during the game
 			self.disconnected = True
@@ -330,30 +395,37 @@ class GameReplay(models.Model):
 	def save_hsreplay_xml(self, parser, meta):
 		from hsreplay.document import HSReplayDocument
 
-		global_game = self.global_game
-		hsreplay_doc = HSReplayDocument.from_parser(parser, build=self.build)
-		game_xml = hsreplay_doc.games[0]
-		game_xml.game_type = global_game.game_type
-		game_xml.id = global_game.game_handle
-		if self.reconnecting:
-			game_xml.reconnecting = True
-
-		game_tree = parser.games[0]
-		for player in game_tree.game.players:
-			player_meta = meta.get("player%i" % (player.player_id), {})
-			player_xml = game_xml.players[player.player_id - 1]
-			player_xml.rank = player_meta.get("rank")
-			player_xml.legendRank = player_meta.get("legend_rank")
-			player_xml.cardback = player_meta.get("cardback")
-			player_xml.deck = player_meta.get("deck")
-
-		xml_str = hsreplay_doc.to_xml()
-		self.hsreplay_version = hsreplay_doc.version
-		# Clean up existing replays first
-		if self.replay_xml.name and default_storage.exists(self.replay_xml.name):
-			self.replay_xml.delete(save=False)
-		xml_file = ContentFile(xml_str)
-		self.replay_xml.save("hsreplay.xml", xml_file, save=False)
+		with influx_phase("xml_serialize"):
+			global_game = self.global_game
+			hsreplay_doc = HSReplayDocument.from_parser(parser, build=self.build)
+			game_xml = hsreplay_doc.games[0]
+			game_xml.game_type = global_game.game_type
+			game_xml.id = global_game.game_handle
+			if self.reconnecting:
+				game_xml.reconnecting = True
+
+			game_tree = parser.games[0]
+			for player in game_tree.game.players:
+				player_meta = meta.get("player%i" % (player.player_id), {})
+				player_xml = game_xml.players[player.player_id - 1]
+				player_xml.rank = player_meta.get("rank")
+				player_xml.legendRank = player_meta.get("legend_rank")
+				player_xml.cardback = player_meta.get("cardback")
+				player_xml.deck = player_meta.get("deck")
+
+			xml_str = hsreplay_doc.to_xml()
+			self.hsreplay_version = hsreplay_doc.version
+
+		with influx_phase("storage_write"):
+			# Clean up existing replays first
+			if self.replay_xml.name and default_storage.exists(self.replay_xml.name):
+				self.replay_xml.delete(save=False)
+			xml_file = ContentFile(xml_str)
+			# Stored gzipped with a Content-Encoding header when the storage
+			# compresses this content type (AWS_IS_GZIPPED / GZIP_CONTENT_TYPES)
+			xml_file.content_type = "application/xml"
+			self.replay_xml.save("hsreplay.xml", xml_file, save=False)
+			record_io(bytes_written=xml_file.size)
 
 		return xml_file
 
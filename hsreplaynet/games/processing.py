@@ -1,16 +1,25 @@
+import codecs
 import json
 import logging
+import sys
 import traceback
-from io import StringIO
+from contextlib import contextmanager
 from dateutil.parser import parse as dateutil_parse
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from hearthstone.enums import CardType, GameTag
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Sum, Value, When
+from hearthstone import hslog
+from hearthstone.entities import Entity
+from hearthstone.enums import BlockType, CardType, GameTag, PlayState, Step, Zone
 from hsreplay.dumper import parse_log
+from hsreplaynet.api.models import AuthToken
 from hsreplaynet.cards.models import Card, Deck
-from hsreplaynet.utils import deduplication_time_range, guess_ladder_season
-from hsreplaynet.utils.instrumentation import influx_metric
-from hsreplaynet.uploads.models import UploadEventStatus
-from .models import GameReplay, GlobalGame, GlobalGamePlayer, PendingReplayOwnership
+from hsreplaynet.stats.models import CardPlayStats, ClassWinRate, DeckWinRate
+from hsreplaynet.utils import deduplication_time_buckets, deduplication_time_range, get_file_hash, guess_ladder_season
+from hsreplaynet.utils.instrumentation import InfluxProfile, error_handler, get_peak_rss, influx_metric, influx_phase, record_io, reset_peak_rss
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus
+from .models import GameReplay, GlobalGame, GlobalGameDedupKey, GlobalGamePlayer, PendingReplayOwnership
 
 
 logger = logging.getLogger(__file__)
@@ -32,6 +41,31 @@ def eligible_for_unification(meta):
 	return all([meta.get("game_handle"), meta.get("client_handle")])
 
 
+def find_global_game_by_dedup_key(dedup_key, game_type, start_time):
+	"""
+	Look up the GlobalGame matching a dedup key (minus its time bucket)
+	and game type with a match start around start_time, using a single
+	indexed query.
+	"""
+	match_start_range = deduplication_time_range(start_time)
+	keys = GlobalGameDedupKey.objects.filter(
+		time_bucket__in=deduplication_time_buckets(start_time),
+		global_game__game_type=game_type,
+		**GlobalGameDedupKey.get_key_fields(**dedup_key)
+	).select_related("global_game")
+
+	# Games hold a key in each bucket of their range
+	matches = list({
+		key.global_game.id: key.global_game for key in keys
+		if match_start_range[0] <= key.global_game.match_start <= match_start_range[1]
+	}.values())
+	if len(matches) > 1:
+		# clearly something's up. invalidate the upload, look into it manually.
+		raise ValidationError("Found too many global games. Mumble mumble...")
+	elif matches:
+		return matches[0]
+
+
 def find_or_create_global_game(game_tree, meta):
 	game_handle = meta.get("game_handle")
 	game_type = meta.get("game_type", 0)
@@ -43,25 +77,20 @@ def find_or_create_global_game(game_tree, meta):
 	else:
 		ladder_season = guess_ladder_season(end_time)
 
-	global_game = None
+	dedup_key = None
 	# Check if we have enough metadata to deduplicate the game
 	if eligible_for_unification(meta):
-		matches = GlobalGame.objects.filter(
-			build=meta["build"],
-			game_type=game_type,
-			game_handle=game_handle,
-			server_address=meta.get("server_ip"),
-			server_port=meta.get("server_port"),
-			match_start__range=deduplication_time_range(start_time),
-		)
-
-		if matches:
-			if len(matches) > 1:
-				# clearly something's up. invalidate the upload, look into it manually.
-				raise ValidationError("Found too many global games. Mumble mumble...")
-			return matches.first(), True
-
-	global_game = GlobalGame.objects.create(
+		dedup_key = {
+			"server_address": meta.get("server_ip"),
+			"server_port": meta.get("server_port"),
+			"game_handle": game_handle,
+			"build": meta["build"],
+		}
+		global_game = find_global_game_by_dedup_key(dedup_key, game_type, start_time)
+		if global_game:
+			return global_game, True
+
+	game_fields = dict(
 		game_handle=game_handle,
 		server_address=meta.get("server_ip"),
 		server_port=meta.get("server_port"),
@@ -77,22 +106,57 @@ def find_or_create_global_game(game_tree, meta):
 		num_turns=game_tree.game.tags.get(GameTag.TURN),
 	)
 
+	if dedup_key:
+		try:
+			with transaction.atomic():
+				global_game = GlobalGame.objects.create(**game_fields)
+				key_fields = GlobalGameDedupKey.get_key_fields(**dedup_key)
+				GlobalGameDedupKey.objects.bulk_create([
+					GlobalGameDedupKey(global_game=global_game, time_bucket=bucket, **key_fields)
+					for bucket in deduplication_time_buckets(start_time)
+				])
+			return global_game, False
+		except IntegrityError:
+			# Another upload of the same game created it in the meantime
+			global_game = find_global_game_by_dedup_key(dedup_key, game_type, start_time)
+			if global_game is not None:
+				return global_game, True
+
+		# A key is held by another game of a shared time bucket which is
+		# out of the deduplication range (or of another game type).
+		# Such games are created without a key and looked up with a range
+		# scan instead, which is only needed on this rare path.
+		influx_metric("global_game_dedup_key_collision", {"value": 1})
+		matches = list(GlobalGame.objects.filter(
+			game_type=game_type,
+			match_start__range=deduplication_time_range(start_time),
+			dedup_keys__isnull=True,
+			**dedup_key
+		)[:2])
+		if len(matches) > 1:
+			raise ValidationError("Found too many global games. Mumble mumble...")
+		elif matches:
+			return matches[0], True
+		logger.warning("Dedup key %r is taken, creating the game without one", dedup_key)
+
+	global_game = GlobalGame.objects.create(**game_fields)
 	return global_game, False
 
 
 def find_or_create_replay(global_game, meta, unified):
 	client_handle = meta.get("client_handle")
 	if unified:
-		# Look for duplicate uploads
-		replays = global_game.replays.filter(
+		# Look for duplicate uploads, in a single query
+		replays = list(global_game.replays.filter(
 			friendly_player_id=meta["friendly_player"],
 			client_handle=client_handle,
-		)
+		)[:2])
 		if len(replays) > 1:
 			raise RuntimeError("Found multiple handles %r for %r" % (client_handle, global_game))
 		elif replays:
-			replay = replays.first()
-			logger.info("Duplicate upload detected: %r", replay)
+			replay = replays[0]
+			# Not the replay itself, as its repr() queries the players
+			logger.info("Duplicate upload detected: %r", replay.shortid)
 			return replay, True
 
 	replay = GameReplay(
@@ -119,9 +183,11 @@ def process_upload_event(upload_event):
 	upload_event.error = ""
 	upload_event.traceback = ""
 	upload_event.save()
+	peak_rss_reset = reset_peak_rss()
 
 	try:
-		replay = do_process_upload_event(upload_event)
+		with InfluxProfile("upload_processing_profile", count_queries=settings.INFLUX_PROFILE_QUERIES):
+			replay = do_process_upload_event(upload_event)
 	except Exception as e:
 		if isinstance(e, ParsingError):
 			upload_event.status = UploadEventStatus.PARSING_ERROR
@@ -139,13 +205,55 @@ def process_upload_event(upload_event):
 		upload_event.game = replay
 		upload_event.status = UploadEventStatus.SUCCESS
 		upload_event.save()
-
-		capture_class_distribution_stats(replay)
+	finally:
+		# Without a reset, the peak covers the whole process (eg. every
+		# upload processed by a warm Lambda container) and is reported
+		# under a separate measurement.
+		peak_rss = get_peak_rss()
+		if peak_rss is not None:
+			influx_metric(
+				"upload_processing_peak_rss_kb" if peak_rss_reset else "process_peak_rss_kb",
+				{"value": peak_rss},
+				status=upload_event.status.name,
+			)
 
 	return replay
 
 
-def capture_class_distribution_stats(replay):
+def schedule_class_distribution_stats(replay, players):
+	"""
+	Captures the class distribution stats of a replay from its players
+	in memory, once the current transaction is committed.
+	Errors are reported but do not fail the upload.
+	"""
+	def capture():
+		try:
+			capture_class_distribution_stats(replay, players)
+		except Exception as e:
+			error_handler(e)
+
+	transaction.on_commit(capture)
+
+
+def schedule_win_rate_rollups(global_game, players):
+	"""
+	Counts the players of a new game into the win rate rollups once the
+	current transaction is committed, in a short transaction of its own so
+	that the busy rollup rows are not locked for the whole upload.
+	Errors are reported but do not fail the upload.
+	"""
+	def record():
+		try:
+			with transaction.atomic():
+				ClassWinRate.objects.record_game(global_game, players)
+				DeckWinRate.objects.record_game(global_game, players)
+		except Exception as e:
+			error_handler(e)
+
+	transaction.on_commit(record)
+
+
+def capture_class_distribution_stats(replay, players=None):
 	fields = {
 		"num_turns": None,
 		"winning_class": None,
@@ -164,7 +272,8 @@ def capture_class_distribution_stats(replay):
 		"loosing_class_name": None,
 	}
 
-	players = replay.global_game.players.all()
+	if players is None:
+		players = replay.global_game.players.select_related("deck_list")
 
 	if len(players) == 2 and any(p.won for p in players):
 		# Only capture stats if it's a typical game with a winner and looser.
@@ -172,17 +281,18 @@ def capture_class_distribution_stats(replay):
 		fields["num_turns"] = replay.global_game.num_turns
 
 		for player in players:
+			hero_class = Card.objects.get_cached(player.hero_id).card_class
 			if player.won:
-				fields["winning_class"] = player.hero.card_class.value
+				fields["winning_class"] = hero_class.value
 				fields["winning_rank"] = player.rank
 				tags["region"] = player.account_hi
 				tags["winning_deck_digest"] = player.deck_list.digest
-				tags["winning_class_name"] = player.hero.card_class.name
+				tags["winning_class_name"] = hero_class.name
 			else:
-				fields["loosing_class"] = player.hero.card_class.value
+				fields["loosing_class"] = hero_class.value
 				fields["loosing_rank"] = player.rank
 				tags["loosing_deck_digest"] = player.deck_list.digest
-				tags["loosing_class_name"] = player.hero.card_class.name
+				tags["loosing_class_name"] = hero_class.name
 
 		influx_metric("class_distribution_stats", fields=fields, **tags)
 
@@ -191,13 +301,19 @@ def capture_class_distribution_stats(replay):
 def parse_upload_event(upload_event, meta):
 	match_start = dateutil_parse(meta["match_start"])
 	upload_event.file.open(mode="rb")
-	log = StringIO(upload_event.file.read().decode("utf-8"))
-	upload_event.file.close()
+	# Decode the log incrementally from the storage file handle rather than
+	# reading it whole, so that large logs never sit in memory as both
+	# bytes and str.
+	log = codecs.getreader("utf-8")(upload_event.file)
 
 	try:
 		parser = parse_log(log, processor="GameState", date=match_start)
 	except Exception as e:
 		raise ParsingError(str(e))  # from e
+	else:
+		record_io(bytes_read=upload_event.file.tell())
+	finally:
+		upload_event.file.close()
 
 	return parser
 
@@ -217,9 +333,8 @@ def validate_parser(parser, meta):
 			raise UnsupportedReplay("No hero found for player %r" % (player.name))
 		player._hero = list(player.heroes)[0]
 
-		try:
-			db_hero = Card.objects.get(id=player._hero.card_id)
-		except Card.DoesNotExist:
+		db_hero = Card.objects.get_cached(player._hero.card_id)
+		if db_hero is None:
 			raise UnsupportedReplay("Hero %r not found." % (player._hero))
 		if db_hero.type != CardType.HERO:
 			raise ValidationError("%r is not a valid hero." % (player._hero))
@@ -243,76 +358,350 @@ def get_player_names(player):
 		return player.name, ""
 
 
+# Deck lists with this many known cards are complete
+FULL_DECK_SIZE = 30
+
+
+def build_global_player(global_game, player, meta):
+	"""
+	Returns an unsaved GlobalGamePlayer for a player of the game tree,
+	without its deck, along with the player's deck list.
+	"""
+	player_meta = meta.get("player%i" % (player.player_id), {})
+	decklist = player_meta.get("deck")
+	if decklist:
+		deck_list_complete = True
+	else:
+		decklist = [c.card_id for c in player.initial_deck if c.card_id]
+		deck_list_complete = len(decklist) >= FULL_DECK_SIZE
+	final_state = player.tags.get(GameTag.PLAYSTATE, 0)
+
+	name, real_name = get_player_names(player)
+
+	game_player = GlobalGamePlayer(
+		game=global_game,
+		player_id=player.player_id,
+		name=name,
+		real_name=real_name,
+		account_hi=player.account_hi,
+		account_lo=player.account_lo,
+		is_ai=player.is_ai,
+		hero_id=player._hero.card_id,
+		hero_premium=player._hero.tags.get(GameTag.PREMIUM, False),
+		rank=player_meta.get("rank"),
+		legend_rank=player_meta.get("legend_rank"),
+		stars=player_meta.get("stars"),
+		wins=player_meta.get("wins"),
+		losses=player_meta.get("losses"),
+		is_first=player.tags.get(GameTag.FIRST_PLAYER, False),
+		final_state=final_state,
+		deck_list_complete=deck_list_complete,
+	)
+
+	return game_player, decklist
+
+
 def create_global_players(global_game, game_tree, meta):
+	"""
+	Creates the GlobalGamePlayers of a new game in a single query.
+	Returns the list of players.
+	"""
+	players = []
 	# Fill the player metadata and objects
 	for player in game_tree.game.players:
-		player_meta = meta.get("player%i" % (player.player_id), {})
-		decklist = player_meta.get("deck")
-		if not decklist:
-			decklist = [c.card_id for c in player.initial_deck if c.card_id]
-		deck, _ = Deck.objects.get_or_create_from_id_list(decklist)
-		final_state = player.tags.get(GameTag.PLAYSTATE, 0)
-
-		name, real_name = get_player_names(player)
-
-		game_player = GlobalGamePlayer(
-			game=global_game,
-			player_id=player.player_id,
-			name=name,
-			real_name=real_name,
-			account_hi=player.account_hi,
-			account_lo=player.account_lo,
-			is_ai=player.is_ai,
-			hero_id=player._hero.card_id,
-			hero_premium=player._hero.tags.get(GameTag.PREMIUM, False),
-			rank=player_meta.get("rank"),
-			legend_rank=player_meta.get("legend_rank"),
-			stars=player_meta.get("stars"),
-			wins=player_meta.get("wins"),
-			losses=player_meta.get("losses"),
-			is_first=player.tags.get(GameTag.FIRST_PLAYER, False),
-			final_state=final_state,
-			deck_list=deck,
-		)
+		game_player, decklist = build_global_player(global_game, player, meta)
+		game_player.deck_list, _ = Deck.objects.get_or_create_from_id_list(decklist)
+		players.append(game_player)
+
+	GlobalGamePlayer.objects.bulk_create(players)
+	return players
+
+
+def iter_packets(packets):
+	"""
+	Yields the packets of a packet tree depth-first, in log order.
+	"""
+	for packet in packets:
+		yield packet
+		if isinstance(packet, hslog.packets.Block):
+			for child in iter_packets(packet.packets):
+				yield child
+
 
-		game_player.save()
+def get_packet_entity_id(entity):
+	if isinstance(entity, Entity):
+		return entity.id
+	elif isinstance(entity, int):
+		return entity
+
+
+def extract_card_play_stats(global_game, game_tree, players):
+	"""
+	Returns unsaved CardPlayStats for the cards of each player's starting
+	deck, from a single pass over the packets of the game tree.
+	"""
+	game = game_tree.game
+	turn, step = 0, Step.INVALID
+	zones, drawn, mulliganed, turns_played = {}, set(), set(), {}
+
+	for packet in iter_packets(game_tree.packets):
+		entity_id = get_packet_entity_id(getattr(packet, "entity", None))
+		if isinstance(packet, hslog.packets.TagChange):
+			if entity_id == game.id:
+				if packet.tag == GameTag.TURN:
+					turn = packet.value
+				elif packet.tag == GameTag.STEP:
+					step = packet.value
+				continue
+			if packet.tag != GameTag.ZONE:
+				continue
+			zone = packet.value
+		elif isinstance(packet, (
+			hslog.packets.FullEntity, hslog.packets.ShowEntity, hslog.packets.ChangeEntity
+		)):
+			zone = dict(packet.tags).get(GameTag.ZONE)
+			if zone is None:
+				continue
+		elif isinstance(packet, hslog.packets.Block):
+			if packet.type == BlockType.PLAY and entity_id not in turns_played:
+				turns_played[entity_id] = turn
+			continue
+		else:
+			continue
+
+		previous_zone = zones.get(entity_id)
+		zones[entity_id] = zone
+		if zone == Zone.HAND:
+			drawn.add(entity_id)
+		elif zone == Zone.DECK and previous_zone == Zone.HAND and step == Step.BEGIN_MULLIGAN:
+			mulliganed.add(entity_id)
+			drawn.discard(entity_id)
+
+	won = {player.player_id: player.won for player in players}
+	card_stats = []
+	for player in game.players:
+		for entity in player.initial_deck:
+			# Unrevealed cards and cards missing from the database are skipped
+			if not entity.card_id or Card.objects.get_cached(entity.card_id) is None:
+				continue
+			card_stats.append(CardPlayStats(
+				game=global_game,
+				player_id=player.player_id,
+				card_id=entity.card_id,
+				drawn=entity.id in drawn,
+				mulliganed=entity.id in mulliganed,
+				turn_played=turns_played.get(entity.id),
+				won=won.get(player.player_id, False),
+			))
+
+	return card_stats
+
+
+# Player fields which a later upload of the same game fills in when they are missing
+MERGED_PLAYER_FIELDS = (
+	"name", "real_name", "account_hi", "account_lo",
+	"rank", "legend_rank", "stars", "wins", "losses",
+)
 
 
 def update_global_players(global_game, game_tree, meta):
-	logger.info("Unified upload. Updating players not implemented yet.")
+	"""
+	Merges the players of another upload of an existing game into its
+	GlobalGamePlayers. Missing fields are filled in, unknown final states
+	are updated and deck lists are replaced by more complete ones.
+
+	The existing players are fetched in one query and all changed fields
+	are written in a single UPDATE. Returns the list of players.
+	"""
+	existing = {
+		p.player_id: p for p in
+		global_game.players.select_related("deck_list").annotate(
+			deck_size=Sum("deck_list__include__count")
+		)
+	}
+	players, missing, changes = [], [], {}
 
+	for player in game_tree.game.players:
+		new_player, decklist = build_global_player(global_game, player, meta)
+		game_player = existing.get(player.player_id)
+		if game_player is None:
+			# The first upload of the game did not get to create its players
+			new_player.deck_list, _ = Deck.objects.get_or_create_from_id_list(decklist)
+			missing.append(new_player)
+			players.append(new_player)
+			continue
+
+		changed = []
+		for field in MERGED_PLAYER_FIELDS:
+			value = getattr(new_player, field)
+			if getattr(game_player, field) in (None, "") and value not in (None, ""):
+				setattr(game_player, field, value)
+				changed.append(field)
+
+		unfinished = (PlayState.INVALID, PlayState.PLAYING)
+		if game_player.final_state in unfinished and new_player.final_state not in unfinished:
+			game_player.final_state = new_player.final_state
+			changed.append("final_state")
+
+		if not game_player.deck_list_complete and (
+			new_player.deck_list_complete or len(decklist) > (game_player.deck_size or 0)
+		):
+			game_player.deck_list, _ = Deck.objects.get_or_create_from_id_list(decklist)
+			changed.append("deck_list")
+			if new_player.deck_list_complete:
+				game_player.deck_list_complete = True
+				changed.append("deck_list_complete")
+
+		if changed:
+			changes[game_player] = changed
+		players.append(game_player)
+
+	if missing:
+		GlobalGamePlayer.objects.bulk_create(missing)
+	if changes:
+		update_players(changes)
+
+	return players
+
+
+def update_players(changes):
+	"""
+	Writes the changed fields of several GlobalGamePlayers in a single UPDATE.
+	`changes` maps each player to the names of its changed fields.
+	"""
+	fields = set(field for names in changes.values() for field in names)
+	updates = {}
+	for name in fields:
+		field = GlobalGamePlayer._meta.get_field(name)
+		output_field = field.target_field if field.is_relation else field
+		whens = [
+			When(id=player.id, then=Value(getattr(player, field.attname), output_field=output_field))
+			for player, names in changes.items() if name in names
+		]
+		updates[name] = Case(*whens, default=F(field.attname), output_field=output_field)
 
-def do_process_upload_event(upload_event):
-	meta = json.loads(upload_event.metadata)
-	parser = parse_upload_event(upload_event, meta)
-	game_tree = validate_parser(parser, meta)
-	global_game, unified = find_or_create_global_game(game_tree, meta)
-	if upload_event.game:
-		replay, duplicate = upload_event.game, True
-	else:
-		replay, duplicate = find_or_create_replay(global_game, meta, unified)
+	GlobalGamePlayer.objects.filter(id__in=[p.id for p in changes]).update(**updates)
+
+
+def find_replay_by_file_hash(upload_event):
+	"""
+	Returns the GameReplay of a byte-identical log which was previously
+	uploaded and processed successfully with the same token, if any.
 
-	if unified or duplicate:
-		update_global_players(global_game, game_tree, meta)
+	The hash of the upload's file is computed first if it is missing.
+	"""
+	if not upload_event.file_hash:
+		upload_event.file.open(mode="rb")
+		try:
+			upload_event.file_hash = get_file_hash(upload_event.file)
+			record_io(bytes_read=upload_event.file.tell())
+		finally:
+			upload_event.file.close()
+
+	original = UploadEvent.objects.filter(
+		file_hash=upload_event.file_hash,
+		token_id=upload_event.token_id,
+		status=UploadEventStatus.SUCCESS,
+		game__isnull=False,
+	).exclude(id=upload_event.id).select_related("game").first()
+
+	if original is not None:
+		return original.game
+
+
+def get_upload_token(upload_event):
+	"""
+	Returns the AuthToken of an UploadEvent along with its user, in one query.
+	"""
+	if upload_event.token_id is None:
+		return None
+	return AuthToken.objects.select_related("user").get(key=upload_event.token_id)
+
+
+@contextmanager
+def atomic_with_commit_phase(phase):
+	"""
+	A transaction.atomic() block whose COMMIT, along with the on_commit
+	callbacks it runs, is timed as an influx_phase of its own.
+	"""
+	atomic = transaction.atomic()
+	atomic.__enter__()
+	try:
+		yield
+	except BaseException:
+		if not atomic.__exit__(*sys.exc_info()):
+			raise
 	else:
-		create_global_players(global_game, game_tree, meta)
+		with influx_phase(phase):
+			atomic.__exit__(None, None, None)
+
+
+def do_process_upload_event(upload_event):
+	if not upload_event.game_id:
+		# Byte-identical re-uploads (eg. client retries) are not parsed again
+		with influx_phase("file_hash"):
+			replay = find_replay_by_file_hash(upload_event)
+		if replay is not None:
+			influx_metric("upload_duplicate_file_skipped", {"value": 1})
+			return replay
 
-	user = upload_event.token.user if upload_event.token else None
-	if user and not replay.user:
+	meta = json.loads(upload_event.metadata)
+	with influx_phase("parse"):
+		parser = parse_upload_event(upload_event, meta)
+	with influx_phase("validate"):
+		game_tree = validate_parser(parser, meta)
+	token = get_upload_token(upload_event)
+	user = token.user if token else None
+
+	# The game and its dedup key are committed right away, so that
+	# concurrent uploads of the other side of the game can find it.
+	with influx_phase("dedup"):
+		global_game, unified = find_or_create_global_game(game_tree, meta)
+		if upload_event.game:
+			replay, duplicate = upload_event.game, True
+		else:
+			replay, duplicate = find_or_create_replay(global_game, meta, unified)
+
+	if user and not replay.user_id:
 		replay.user = user
 		replay.visibility = user.default_replay_visibility
 
 	# Create and save hsreplay.xml file
+	# This is done before the transaction below to not hold it open during the upload.
 	file = replay.save_hsreplay_xml(parser, meta)
 	influx_metric("replay_xml_num_bytes", {"size": file.size})
-	replay.update_final_states()
-	replay.save()
-
-	# Manual uploads (admin/command line) don't have tokens attached
-	if user is None and upload_event.token is not None:
-		# If the auth token has not yet been claimed, create
-		# a pending claim for the replay for when it will be.
-		claim = PendingReplayOwnership(replay=replay, token=upload_event.token)
-		claim.save()
+
+	# The players, the replay and its claim are written in a single transaction
+	with atomic_with_commit_phase("db_commit"):
+		with influx_phase("players"):
+			if unified or duplicate:
+				players = update_global_players(global_game, game_tree, meta)
+			else:
+				players = create_global_players(global_game, game_tree, meta)
+
+		if not (unified or duplicate):
+			with influx_phase("card_stats"):
+				CardPlayStats.objects.bulk_create(
+					extract_card_play_stats(global_game, game_tree, players)
+				)
+
+		with influx_phase("replay_save"):
+			friendly_player = None
+			for player in players or []:
+				if player.player_id == replay.friendly_player_id:
+					friendly_player = player
+			replay.update_final_states(friendly_player)
+			replay.save()
+
+			# Manual uploads (admin/command line) don't have tokens attached
+			if user is None and token is not None:
+				# If the auth token has not yet been claimed, create
+				# a pending claim for the replay for when it will be.
+				claim = PendingReplayOwnership(replay=replay, token=token)
+				claim.save()
+
+		schedule_class_distribution_stats(replay, players)
+		if not (unified or duplicate):
+			schedule_win_rate_rollups(global_game, players)
 
 	return replay
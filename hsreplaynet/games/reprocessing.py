@@ -0,0 +1,236 @@
+"""
+Reprocessing of games from their stored hsreplay.xml.
+
+Backfills of derived data (final states, player fields...) only need what
+is already in the replay XML, which is much cheaper to read than parsing
+the original Power.log again (see queue_upload_event_for_processing).
+"""
+from collections import namedtuple
+from gzip import GzipFile
+from io import BytesIO
+from multiprocessing import Pool
+from django.db import connections, transaction
+from django.db.models import Sum
+from hearthstone.enums import GameTag, PlayState
+from hsreplay.utils import ElementTree
+from hsreplaynet.cards.models import Deck
+from hsreplaynet.utils.instrumentation import error_handler, record_io
+from .models import GameReplay, GlobalGame
+
+
+# Derived data which can be recomputed from the replay XML
+REPROCESSABLE_FIELDS = ("final_states", "players", "game")
+
+GZIP_MAGIC = b"\x1f\x8b"
+
+
+class ReplayPlayer(namedtuple("ReplayPlayer", (
+	"player_id", "name", "account_hi", "account_lo",
+	"rank", "legend_rank", "deck", "final_state",
+))):
+	__slots__ = ()
+
+	@property
+	def is_ai(self):
+		return self.account_lo == 0
+
+
+ReplaySummary = namedtuple("ReplaySummary", ("players", "num_turns", "num_entities"))
+
+
+class ReprocessingError(Exception):
+	pass
+
+
+def load_replay_xml(replay):
+	"""
+	Returns the Game element of the stored hsreplay.xml of a replay.
+	"""
+	replay.replay_xml.open(mode="rb")
+	try:
+		data = replay.replay_xml.read()
+	finally:
+		replay.replay_xml.close()
+	record_io(bytes_read=len(data))
+
+	# Files stored gzipped (AWS_IS_GZIPPED) are read back as is
+	if data.startswith(GZIP_MAGIC):
+		data = GzipFile(fileobj=BytesIO(data)).read()
+
+	game = ElementTree.fromstring(data).find("Game")
+	if game is None:
+		raise ReprocessingError("No game found in %r" % (replay.replay_xml.name))
+	return game
+
+
+def _int_or_none(value):
+	return int(value) if value not in (None, "") else None
+
+
+def summarize_replay_xml(game):
+	"""
+	Returns a ReplaySummary of a Game element, with the final state of
+	its players, in a single pass over the elements.
+	"""
+	game_entity = None
+	players, player_entities, play_states = {}, {}, {}
+	num_turns, num_entities = None, 0
+
+	for element in game.iter():
+		if element.tag in ("GameEntity", "Player", "FullEntity"):
+			num_entities += 1
+			entity_id = int(element.attrib["id"])
+			tags = {
+				int(tag.attrib["tag"]): int(tag.attrib["value"])
+				for tag in element.findall("Tag")
+			}
+			if element.tag == "GameEntity":
+				game_entity = entity_id
+				num_turns = tags.get(GameTag.TURN, num_turns)
+			elif element.tag == "Player":
+				player_entities[entity_id] = element
+				play_states[entity_id] = tags.get(GameTag.PLAYSTATE, PlayState.INVALID)
+		elif element.tag == "TagChange":
+			entity_id, tag = int(element.attrib["entity"]), int(element.attrib["tag"])
+			if entity_id == game_entity and tag == GameTag.TURN:
+				num_turns = int(element.attrib["value"])
+			elif entity_id in player_entities and tag == GameTag.PLAYSTATE:
+				play_states[entity_id] = int(element.attrib["value"])
+
+	for entity_id, element in player_entities.items():
+		player_id = int(element.attrib["playerID"])
+		players[player_id] = ReplayPlayer(
+			player_id=player_id,
+			name=element.attrib.get("name"),
+			account_hi=_int_or_none(element.attrib.get("accountHi")),
+			account_lo=_int_or_none(element.attrib.get("accountLo")),
+			rank=_int_or_none(element.attrib.get("rank")),
+			legend_rank=_int_or_none(element.attrib.get("legendRank")),
+			deck=[card.attrib["id"] for card in element.findall("Deck/Card")],
+			final_state=PlayState(play_states[entity_id]),
+		)
+
+	return ReplaySummary(players, num_turns, num_entities)
+
+
+def reprocess_replay(replay, fields=REPROCESSABLE_FIELDS):
+	"""
+	Recomputes the given REPROCESSABLE_FIELDS of a replay, its game and
+	players from the stored replay XML. Returns whether anything changed.
+	"""
+	from .processing import get_player_names, update_players
+
+	summary = summarize_replay_xml(load_replay_xml(replay))
+	global_game = replay.global_game
+	changes = {}
+
+	def update(obj, field, value):
+		if value is not None and getattr(obj, field) != value:
+			setattr(obj, field, value)
+			changes.setdefault(obj, []).append(field)
+
+	with transaction.atomic():
+		players = global_game.players.select_related("deck_list").annotate(
+			deck_size=Sum("deck_list__include__count")
+		)
+		friendly_player = None
+		for player in players:
+			if player.player_id == replay.friendly_player_id:
+				friendly_player = player
+			replay_player = summary.players.get(player.player_id)
+			if replay_player is None:
+				continue
+
+			if "final_states" in fields:
+				update(player, "final_state", replay_player.final_state)
+
+			if "players" in fields:
+				name, real_name = None, None
+				if replay_player.name:
+					name, real_name = get_player_names(replay_player)
+				for field, value in (
+					("name", name),
+					("real_name", real_name),
+					("account_hi", replay_player.account_hi),
+					("account_lo", replay_player.account_lo),
+					("rank", replay_player.rank),
+					("legend_rank", replay_player.legend_rank),
+				):
+					update(player, field, value)
+				if len(replay_player.deck) > (player.deck_size or 0):
+					deck, _ = Deck.objects.get_or_create_from_id_list(replay_player.deck)
+					update(player, "deck_list", deck)
+
+		if changes:
+			update_players(changes)
+
+		if "game" in fields:
+			update(global_game, "num_turns", summary.num_turns)
+			update(global_game, "num_entities", summary.num_entities)
+			if global_game in changes:
+				GlobalGame.objects.filter(id=global_game.id).update(
+					num_turns=global_game.num_turns, num_entities=global_game.num_entities
+				)
+
+		if "final_states" in fields and friendly_player is not None:
+			won, disconnected = replay.won, replay.disconnected
+			replay.won, replay.disconnected = None, False
+			replay.update_final_states(friendly_player)
+			if (replay.won, replay.disconnected) != (won, disconnected):
+				replay.save(update_fields=["won", "disconnected"])
+				changes[replay] = ["won", "disconnected"]
+
+	return bool(changes)
+
+
+def reprocess_replays(replay_ids, fields=REPROCESSABLE_FIELDS):
+	"""
+	Reprocesses the replays with the given IDs.
+	Errors are reported and counted. Returns (num_changed, num_failed).
+	"""
+	changed, failed = 0, 0
+	replays = GameReplay.objects.filter(id__in=replay_ids).select_related("global_game")
+	for replay in replays:
+		try:
+			if reprocess_replay(replay, fields):
+				changed += 1
+		except Exception as e:
+			error_handler(e)
+			failed += 1
+	return changed, failed
+
+
+def _reprocess_chunk(args):
+	replay_ids, fields = args
+	return (len(replay_ids), ) + reprocess_replays(replay_ids, fields)
+
+
+def reprocess_queryset(queryset, fields=REPROCESSABLE_FIELDS, processes=1, chunk_size=100):
+	"""
+	Reprocesses a GameReplay queryset in chunks of `chunk_size` replays,
+	across a pool of `processes` worker processes.
+	Yields (num_done, num_changed, num_failed) after every chunk.
+	"""
+	ids = list(queryset.order_by("id").values_list("id", flat=True))
+	chunks = [(ids[i:i + chunk_size], fields) for i in range(0, len(ids), chunk_size)]
+	done, changed, failed = 0, 0, 0
+
+	if processes > 1:
+		# Forked workers must not share the parent's database connections
+		connections.close_all()
+		pool = Pool(processes, initializer=connections.close_all)
+		results = pool.imap_unordered(_reprocess_chunk, chunks)
+	else:
+		pool = None
+		results = (_reprocess_chunk(chunk) for chunk in chunks)
+
+	try:
+		for chunk_done, chunk_changed, chunk_failed in results:
+			done += chunk_done
+			changed += chunk_changed
+			failed += chunk_failed
+			yield done, changed, failed
+	finally:
+		if pool is not None:
+			pool.terminate()
+			pool.join()
@@ -1,24 +1,64 @@
 import json
 import logging
+import os
 import tempfile
 from base64 import b64decode
 from django.conf import settings
-from django.contrib.sessions.middleware import SessionMiddleware
-from rest_framework.test import APIRequestFactory
-from hsreplaynet.api.views import UploadEventViewSet
+from django.db import connection
+from rest_framework.exceptions import APIException, NotAuthenticated, PermissionDenied
+from hsreplaynet.api.authentication import AuthTokenAuthentication
+from hsreplaynet.api.permissions import APIKeyPermission
 from hsreplaynet.uploads.models import UploadEvent, UploadEventType, RawUpload, _generate_upload_key
-from hsreplaynet.uploads.processing import queue_upload_event_for_processing
+from hsreplaynet.uploads.processing import create_upload_event, queue_upload_event_for_processing
 from hsreplaynet.utils import instrumentation, aws
 
 
-def emulate_api_request(path, data, headers):
+def process_records(event, process_record):
 	"""
-	Emulates an API request from the API gateway's data.
+	Calls process_record() on every record of a (possibly batched) Lambda event.
+
+	All records are processed on the same DB connection and a failing record
+	does not prevent the rest of the batch from being processed.
+	Returns the failed records in the format of an SQS partial batch response.
+	For events which do not come from SQS, the first error is re-raised once
+	the whole batch has been processed so the invocation is still retried.
 	"""
-	factory = APIRequestFactory()
-	request = factory.post(path, data, **headers)
-	SessionMiddleware().process_request(request)
-	return request
+	logger = logging.getLogger("hsreplaynet.lambdas.process_records")
+	records = event["Records"]
+	reraise = not all(r.get("eventSource") == "aws:sqs" for r in records)
+	failures = []
+	first_error = None
+
+	for record in records:
+		os.environ["TRACING_REQUEST_ID"] = instrumentation.get_record_tracing_id(record)
+		success = True
+		try:
+			process_record(record)
+		except Exception as e:
+			logger.exception("Failed to process record: %r", e)
+			success = False
+			failures.append({"itemIdentifier": aws.get_record_id(record)})
+			if reraise and first_error is None:
+				first_error = e
+			else:
+				instrumentation.error_handler(e)
+
+			# Don't let a broken connection fail the rest of the batch
+			if connection.connection is not None and not connection.is_usable():
+				connection.close()
+		finally:
+			instrumentation.influx_metric(
+				"lambda_record_processed",
+				{"value": 1},
+				handler=process_record.__name__,
+				success=success,
+			)
+
+	logger.info("Processed %i records, %i failed.", len(records), len(failures))
+	if first_error is not None:
+		raise first_error
+
+	return {"batchItemFailures": failures}
 
 
 @instrumentation.lambda_handler(name="ProcessS3CreateObjectV1")
@@ -26,12 +66,16 @@ def process_s3_create_handler(event, context):
 	"""
 	A handler that is triggered whenever a "..power.log" suffixed object is created in S3.
 	"""
+	return process_records(event, process_s3_create_record)
+
+
+def process_s3_create_record(record):
 	logger = logging.getLogger("hsreplaynet.lambdas.process_s3_create_handler")
 
-	s3_event = event["Records"][0]["s3"]
-	raw_upload = RawUpload.from_s3_event(s3_event)
-	logger.info("Processing a RawUpload from an S3 event: %s", str(raw_upload))
-	process_raw_upload(raw_upload)
+	for s3_record in aws.get_s3_event_records(record):
+		raw_upload = RawUpload.from_s3_event(s3_record["s3"])
+		logger.info("Processing a RawUpload from an S3 event: %s", str(raw_upload))
+		process_raw_upload(raw_upload)
 
 
 @instrumentation.lambda_handler(name="ProcessRawUploadSnsHandlerV1")
@@ -39,9 +83,13 @@ def process_raw_upload_sns_handler(event, context):
 	"""
 	A handler that subscribes to an SNS queue to support processing of raw log uploads.
 	"""
+	return process_records(event, process_raw_upload_record)
+
+
+def process_raw_upload_record(record):
 	logger = logging.getLogger("hsreplaynet.lambdas.process_raw_upload_sns_handler")
 
-	message = json.loads(event["Records"][0]["Sns"]["Message"])
+	message = aws.get_record_message(record)
 	raw_upload = RawUpload.from_sns_message(message)
 	logger.info("Processing a RawUpload from an SNS message: %s", str(raw_upload))
 	process_raw_upload(raw_upload)
@@ -57,48 +105,41 @@ def process_raw_upload(raw_upload):
 	logger.info("Starting processing for RawUpload: %s", str(raw_upload))
 
 	descriptor = raw_upload.descriptor
+	in_place = settings.UPLOAD_RAW_LOGS_IN_PLACE
 
-	new_key = _generate_upload_key(raw_upload.timestamp, raw_upload.shortid)
-	new_bucket = settings.AWS_STORAGE_BUCKET_NAME
+	if in_place:
+		# The UploadEvent references the raw log where it is
+		# (see hsreplaynet.uploads.storage.RawUploadS3Storage)
+		new_key = raw_upload.log_key
+	else:
+		new_key = _generate_upload_key(raw_upload.timestamp, raw_upload.shortid)
+		new_bucket = settings.AWS_STORAGE_BUCKET_NAME
 
-	# First we copy the log to the proper location
-	copy_source = "%s/%s" % (raw_upload.bucket, raw_upload.log_key)
+		# First we copy the log to the proper location
+		copy_source = "%s/%s" % (raw_upload.bucket, raw_upload.log_key)
 
-	logger.info("*** COPY RAW LOG TO NEW LOCATION ***")
-	logger.info("SOURCE: %s" % copy_source)
-	logger.info("DESTINATION: %s/%s" % (new_bucket, new_key))
+		logger.info("*** COPY RAW LOG TO NEW LOCATION ***")
+		logger.info("SOURCE: %s" % copy_source)
+		logger.info("DESTINATION: %s/%s" % (new_bucket, new_key))
 
-	aws.S3.copy_object(
-		Bucket=new_bucket,
-		Key=new_key,
-		CopySource=copy_source,
-	)
+		aws.S3.copy_object(
+			Bucket=new_bucket,
+			Key=new_key,
+			CopySource=copy_source,
+		)
 
-	# Then we build the request and send it to DRF
-	# If "file" is a string, DRF will interpret as a S3 Key
 	upload_metadata = descriptor["upload_metadata"]
 	upload_metadata["shortid"] = descriptor["shortid"]
-	upload_metadata["file"] = new_key
 	upload_metadata["type"] = int(UploadEventType.POWER_LOG)
 
-	gateway_headers = descriptor["gateway_headers"]
-	headers = {
-		"HTTP_X_FORWARDED_FOR": descriptor["source_ip"],
-		"HTTP_AUTHORIZATION": gateway_headers["Authorization"],
-		"HTTP_X_API_KEY": gateway_headers["X-Api-Key"],
-		"format": "json",
-	}
-
-	path = descriptor["event"]["path"]
-	request = emulate_api_request(path, upload_metadata, headers)
-
 	try:
-		result = create_upload_event_from_request(request)
+		result = create_upload_event_from_descriptor(descriptor, upload_metadata, new_key)
 	except Exception as e:
 		logger.info("Create Upload Event Failed!!")
 
-		# If DRF fails: delete the copy of the log to not leave orphans around.
-		aws.S3.delete_object(Bucket=new_bucket, Key=new_key)
+		if not in_place:
+			# If creation fails: delete the copy of the log to not leave orphans around.
+			aws.S3.delete_object(Bucket=new_bucket, Key=new_key)
 
 		# Now move the failed upload into the failed location for easier inspection.
 		raw_upload.make_failed(str(e))
@@ -109,49 +150,73 @@ def process_raw_upload(raw_upload):
 	else:
 		logger.info("Create Upload Event Success - RawUpload will be deleted.")
 
-		# If DRF returns success, then we delete the raw_upload
-		raw_upload.delete()
+		# If the UploadEvent was created, we delete the raw_upload
+		# (except for the log if the UploadEvent now references it)
+		raw_upload.delete(keep_log=in_place)
 
 	logger.info("Processing RawUpload Complete.")
 	return result
 
 
-def create_upload_event_from_request(request):
-	logger = logging.getLogger("hsreplaynet.lambdas.create_upload_event_from_request")
-	view = UploadEventViewSet.as_view({"post": "create"})
+def authenticate_raw_upload(gateway_headers):
+	"""
+	Performs the checks of UploadEventViewSet (AuthTokenAuthentication,
+	RequireAuthToken and APIKeyPermission) on the headers received by
+	the API gateway with a raw upload.
+	Returns a (token, api_key) tuple.
+	"""
+	auth = gateway_headers.get("Authorization", "").split()
+	if len(auth) != 2 or auth[0].lower() != "token":
+		raise NotAuthenticated("Invalid token header.")
+	user, token = AuthTokenAuthentication().authenticate_credentials(auth[1])
+
+	api_key = APIKeyPermission().get_api_key(gateway_headers.get("X-Api-Key", ""))
+	if api_key is None or not api_key.enabled:
+		raise PermissionDenied()
+
+	return token, api_key
 
-	response = view(request)
-	response.render()
-	logger.info("Response (code=%r): %s", response.status_code, response.content)
 
-	if response.status_code != 201:
+def create_upload_event_from_descriptor(descriptor, upload_metadata, file_key):
+	logger = logging.getLogger("hsreplaynet.lambdas.create_upload_event_from_descriptor")
+
+	try:
+		token, api_key = authenticate_raw_upload(descriptor["gateway_headers"])
+		upload_event = create_upload_event(
+			upload_metadata, token, api_key, descriptor["source_ip"], file_key=file_key
+		)
+	except APIException as e:
+		logger.info("Response (code=%r): %s", e.status_code, e.detail)
 		result = {
 			"result_type": "VALIDATION_ERROR",
-			"status_code": response.status_code,
-			"body": response.content,
+			"status_code": e.status_code,
+			"body": e.detail,
 		}
 		raise Exception(json.dumps(result))
 
-	# Extract the upload_event from the response and queue it for processing
-	upload_event_id = response.data["id"]
-	logger.info("Created UploadEvent %r", upload_event_id)
-	queue_upload_event_for_processing(upload_event_id)
+	logger.info("Created UploadEvent %r", upload_event.id)
+	queue_upload_event_for_processing(upload_event.id)
 
 	return {
 		"result_type": "SUCCESS",
-		"body": response.content,
+		"body": json.dumps({"id": upload_event.id, "shortid": upload_event.shortid}),
 	}
 
 
-@instrumentation.lambda_handler(cpu_seconds=120, name="ProcessUploadEventV1")
+@instrumentation.lambda_handler(cpu_seconds=300, name="ProcessUploadEventV1")
 def process_upload_event_handler(event, context):
 	"""
 	This handler is triggered by SNS whenever someone
 	publishes a message to the SNS_PROCESS_UPLOAD_EVENT_TOPIC.
+	Every record of the event is processed.
 	"""
+	return process_records(event, process_upload_event_record)
+
+
+def process_upload_event_record(record):
 	logger = logging.getLogger("hsreplaynet.lambdas.process_upload_event_handler")
 
-	message = json.loads(event["Records"][0]["Sns"]["Message"])
+	message = aws.get_record_message(record)
 	logger.info("SNS message: %r", message)
 
 	# This should never raise DoesNotExist.
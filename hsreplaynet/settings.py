@@ -142,7 +142,8 @@ DEFAULT_FILE_STORAGE = "django.core.files.storage.FileSystemStorage"
 STATIC_URL = "/static/"
 
 if ENV_PROD:
-	DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
+	# S3Boto3Storage which also resolves raw upload keys in the raw upload bucket
+	DEFAULT_FILE_STORAGE = "hsreplaynet.uploads.storage.RawUploadS3Storage"
 	STATIC_URL = "https://static.hsreplay.net/static/"
 
 	# S3
@@ -170,6 +171,11 @@ if ENV_PROD:
 # WARNING: To change this it must also be updated in isolated.uploaders.py
 S3_RAW_LOG_UPLOAD_BUCKET = "hsreplaynet-raw-log-uploads"
 
+# Whether UploadEvents reference their raw log in place in the raw upload bucket
+# instead of a copy of it in AWS_STORAGE_BUCKET_NAME. Only the descriptor is
+# deleted once the UploadEvent is created.
+UPLOAD_RAW_LOGS_IN_PLACE = False
+
 SNS_PROCESS_RAW_LOG_UPOAD_TOPIC = "process_s3_raw_upload"
 SNS_PROCESS_UPLOAD_EVENT_TOPIC = None
 
@@ -202,6 +208,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+if ENV_PROD:
+	# Shared by the web workers and the lambdas (created by `manage.py createcachetable`)
+	CACHES = {
+		"default": {
+			"BACKEND": "django.core.cache.backends.db.DatabaseCache",
+			"LOCATION": "django_cache",
+		}
+	}
+else:
+	CACHES = {
+		"default": {
+			"BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+		}
+	}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.9/topics/i18n/
 
@@ -252,6 +277,19 @@ REST_FRAMEWORK = {
 HDT_DOWNLOAD_URL = "https://hsreplay.net/pages/beta/"
 
 INFLUX_ENABLED = ENV_PROD
+# Influx points are buffered and written in batches of up to this many points,
+# or once the oldest buffered point is this many seconds old.
+INFLUX_BUFFER_MAX_POINTS = 100
+INFLUX_BUFFER_MAX_AGE = 10
+# Whether upload processing profiles count the DB queries of each phase.
+# This enables query logging on the connection while an upload is processed.
+INFLUX_PROFILE_QUERIES = False
+
+# How long AuthTokens and APIKeys looked up by the API are cached, in seconds.
+# Saving a token, key or user invalidates its entry in the cache backend, so
+# the backend must be shared by all processes (see CACHES): with the local
+# memory cache, other processes keep serving revoked credentials until expiry.
+AUTH_CACHE_TTL = 60
 
 # Used for compiling SCSS
 SCSS_INPUT_FILE = os.path.join(BASE_DIR, "hsreplaynet", "static", "styles", "main.scss")
@@ -7,7 +7,7 @@ import {image, cardArt} from "./helpers";
 
 function renderReplayListing() {
 	let r = $.getJSON("/api/v1/games", {username: $("body").data("username")}, function(data) {
-		if (data.count) {
+		if (data.results.length) {
 			ReactDOM.render(
 				<GameHistoryList
 					image={image}
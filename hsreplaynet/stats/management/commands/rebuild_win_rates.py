@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from hsreplaynet.games.models import GlobalGamePlayer
+from ...models import ClassWinRate, DeckWinRate
+
+
+class Command(BaseCommand):
+	help = "Rebuild the class and deck win rate rollups from the processed games."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--season", type=int, help="Only rebuild this ladder season")
+
+	def handle(self, *args, **options):
+		players = GlobalGamePlayer.objects.all()
+		season = options["season"]
+		if season is not None:
+			players = players.filter(game__ladder_season=season)
+
+		for model in (ClassWinRate, DeckWinRate):
+			rollups = model.objects.all()
+			if season is not None:
+				rollups = rollups.filter(ladder_season=season)
+
+			with transaction.atomic():
+				rollups.delete()
+				count = model.objects.rebuild(players)
+			self.stdout.write("Rebuilt %i %s rows" % (count, model.__name__))
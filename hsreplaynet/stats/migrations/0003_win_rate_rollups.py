@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import hearthstone.enums
+import hsreplaynet.stats.models
+import hsreplaynet.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cards', '0005_cardcatalogversion'),
+        ('stats', '0002_auto_20160708_1306'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ClassWinRate',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('player_class', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'INVALID'), (1, 'DEATHKNIGHT'), (2, 'DRUID'), (3, 'HUNTER'), (4, 'MAGE'), (5, 'PALADIN'), (6, 'PRIEST'), (7, 'ROGUE'), (8, 'SHAMAN'), (9, 'WARLOCK'), (10, 'WARRIOR'), (11, 'DREAM'), (12, 'NEUTRAL')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hearthstone.enums.CardClass)])),
+                ('rank_bracket', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'UNKNOWN'), (1, 'LEGEND'), (2, 'RANKS_1_5'), (3, 'RANKS_6_10'), (4, 'RANKS_11_15'), (5, 'RANKS_16_20'), (6, 'RANKS_21_25')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hsreplaynet.stats.models.RankBracket)])),
+                ('game_type', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'BGT_UNKNOWN'), (1, 'BGT_FRIENDS'), (2, 'BGT_RANKED_STANDARD'), (3, 'BGT_ARENA'), (4, 'BGT_VS_AI'), (5, 'BGT_TUTORIAL'), (6, 'BGT_ASYNC'), (9, 'BGT_CASUAL_STANDARD_NEWBIE'), (10, 'BGT_CASUAL_STANDARD_NORMAL'), (11, 'BGT_TEST1'), (12, 'BGT_TEST2'), (13, 'BGT_TEST3'), (16, 'BGT_TAVERNBRAWL_PVP'), (17, 'BGT_TAVERNBRAWL_1P_VERSUS_AI'), (18, 'BGT_TAVERNBRAWL_2P_COOP'), (30, 'BGT_RANKED_WILD'), (31, 'BGT_CASUAL_WILD'), (40, 'BGT_FSG_BRAWL_VS_FRIEND'), (41, 'BGT_FSG_BRAWL_PVP'), (42, 'BGT_FSG_BRAWL_1P_VERSUS_AI'), (43, 'BGT_FSG_BRAWL_2P_COOP')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hearthstone.enums.BnetGameType)])),
+                ('ladder_season', models.IntegerField(default=0)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='DeckWinRate',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('player_class', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'INVALID'), (1, 'DEATHKNIGHT'), (2, 'DRUID'), (3, 'HUNTER'), (4, 'MAGE'), (5, 'PALADIN'), (6, 'PRIEST'), (7, 'ROGUE'), (8, 'SHAMAN'), (9, 'WARLOCK'), (10, 'WARRIOR'), (11, 'DREAM'), (12, 'NEUTRAL')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hearthstone.enums.CardClass)])),
+                ('rank_bracket', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'UNKNOWN'), (1, 'LEGEND'), (2, 'RANKS_1_5'), (3, 'RANKS_6_10'), (4, 'RANKS_11_15'), (5, 'RANKS_16_20'), (6, 'RANKS_21_25')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hsreplaynet.stats.models.RankBracket)])),
+                ('game_type', hsreplaynet.utils.fields.IntEnumField(choices=[(0, 'BGT_UNKNOWN'), (1, 'BGT_FRIENDS'), (2, 'BGT_RANKED_STANDARD'), (3, 'BGT_ARENA'), (4, 'BGT_VS_AI'), (5, 'BGT_TUTORIAL'), (6, 'BGT_ASYNC'), (9, 'BGT_CASUAL_STANDARD_NEWBIE'), (10, 'BGT_CASUAL_STANDARD_NORMAL'), (11, 'BGT_TEST1'), (12, 'BGT_TEST2'), (13, 'BGT_TEST3'), (16, 'BGT_TAVERNBRAWL_PVP'), (17, 'BGT_TAVERNBRAWL_1P_VERSUS_AI'), (18, 'BGT_TAVERNBRAWL_2P_COOP'), (30, 'BGT_RANKED_WILD'), (31, 'BGT_CASUAL_WILD'), (40, 'BGT_FSG_BRAWL_VS_FRIEND'), (41, 'BGT_FSG_BRAWL_PVP'), (42, 'BGT_FSG_BRAWL_1P_VERSUS_AI'), (43, 'BGT_FSG_BRAWL_2P_COOP')], default=0, validators=[hsreplaynet.utils.fields.IntEnumValidator(hearthstone.enums.BnetGameType)])),
+                ('ladder_season', models.IntegerField(default=0)),
+                ('games', models.PositiveIntegerField(default=0)),
+                ('wins', models.PositiveIntegerField(default=0)),
+                ('deck', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cards.Deck')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='classwinrate',
+            unique_together=set([('player_class', 'rank_bracket', 'game_type', 'ladder_season')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='deckwinrate',
+            unique_together=set([('deck', 'player_class', 'rank_bracket', 'game_type', 'ladder_season')]),
+        ),
+    ]
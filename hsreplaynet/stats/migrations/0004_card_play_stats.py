@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:43
+from __future__ import unicode_literals
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+import hsreplaynet.utils.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('games', '0013_backfill_globalgamededupkey'),
+        ('cards', '0005_cardcatalogversion'),
+        ('stats', '0003_win_rate_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CardPlayStats',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('player_id', hsreplaynet.utils.fields.PlayerIDField(choices=[(1, 1), (2, 2)], validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(2)])),
+                ('drawn', models.BooleanField(default=False, help_text='Whether the card was drawn or kept in the opening hand.')),
+                ('mulliganed', models.BooleanField(default=False)),
+                ('turn_played', models.PositiveSmallIntegerField(blank=True, help_text='Game turn the card was first played on.', null=True)),
+                ('won', models.BooleanField(default=False, help_text="Whether the card's player won.")),
+                ('card', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='cards.Card')),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='card_stats', to='games.GlobalGame')),
+            ],
+        ),
+    ]
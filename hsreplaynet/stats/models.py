@@ -1,4 +1,11 @@
-from django.db import models
+from enum import IntEnum
+from django.db import IntegrityError, models, transaction
+from django.db.models import Case, Count, F, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
+from hearthstone.enums import BnetGameType, CardClass, PlayState
+from hsreplaynet.cards.models import Card, Deck
+from hsreplaynet.games.models import GlobalGame
+from hsreplaynet.utils.fields import IntEnumField, PlayerIDField
 
 
 class StatsMeta(models.Model):
@@ -52,3 +59,232 @@ class RankedSeasonStats(models.Model):
 	best_stars = models.PositiveIntegerField()
 	wins = models.PositiveIntegerField()
 	streak = models.PositiveIntegerField()
+
+
+class RankBracket(IntEnum):
+	UNKNOWN = 0
+	LEGEND = 1
+	RANKS_1_5 = 2
+	RANKS_6_10 = 3
+	RANKS_11_15 = 4
+	RANKS_16_20 = 5
+	RANKS_21_25 = 6
+
+	@classmethod
+	def from_rank(cls, rank):
+		if rank is None or not 0 <= rank <= 25:
+			return cls.UNKNOWN
+		if rank == 0:
+			return cls.LEGEND
+		return cls(cls.RANKS_1_5 + (rank - 1) // 5)
+
+
+# Players of unfinished or invalid games are not counted
+DECIDED_PLAY_STATES = (
+	PlayState.WINNING, PlayState.LOSING, PlayState.WON, PlayState.LOST, PlayState.TIED
+)
+WON_PLAY_STATES = (PlayState.WINNING, PlayState.WON)
+
+
+def rank_bracket_expression(field="rank"):
+	"""
+	The RankBracket of a GlobalGamePlayer rank, as a query expression.
+	Matches RankBracket.from_rank().
+	"""
+	whens = [
+		When(**{field + "__lt": 0, "then": Value(RankBracket.UNKNOWN.value)}),
+		When(**{field: 0, "then": Value(RankBracket.LEGEND.value)}),
+	]
+	for bracket in range(RankBracket.RANKS_1_5, RankBracket.RANKS_21_25 + 1):
+		max_rank = (bracket - RankBracket.RANKS_1_5 + 1) * 5
+		whens.append(When(**{field + "__lte": max_rank, "then": Value(bracket)}))
+	return Case(*whens, default=Value(RankBracket.UNKNOWN.value), output_field=IntegerField())
+
+
+class WinRateRollupManager(models.Manager):
+	def record_game(self, global_game, players):
+		"""
+		Count the players of a newly created GlobalGame into the rollup.
+		Rows are updated in a stable order to avoid deadlocks between
+		concurrent uploads.
+		"""
+		increments = {}
+		for player in players:
+			if player.final_state not in DECIDED_PLAY_STATES:
+				continue
+			if not self.model.counts_player(player):
+				continue
+			key = tuple(sorted(self.model.get_key(global_game, player).items()))
+			games, wins = increments.get(key, (0, 0))
+			increments[key] = (games + 1, wins + (1 if player.won else 0))
+
+		for key, (games, wins) in sorted(increments.items()):
+			self.increment(dict(key), games, wins)
+
+	def increment(self, key, games, wins):
+		rows = self.filter(**key)
+		if not rows.update(games=F("games") + games, wins=F("wins") + wins):
+			try:
+				with transaction.atomic():
+					self.create(games=games, wins=wins, **key)
+			except IntegrityError:
+				# The row was created concurrently
+				rows.update(games=F("games") + games, wins=F("wins") + wins)
+
+	def rebuild(self, players, batch_size=1000):
+		"""
+		Replace the rollup rows of the given GlobalGamePlayer queryset
+		with rows aggregated from it, and return how many were created.
+		"""
+		expressions = self.model.get_key_expressions()
+		players = players.filter(final_state__in=DECIDED_PLAY_STATES, **self.model.get_player_filter())
+		rows = players.annotate(**expressions)
+		rows = rows.values(*expressions).order_by().annotate(
+			rollup_games=Count("id"),
+			rollup_wins=Sum(Case(
+				When(final_state__in=WON_PLAY_STATES, then=Value(1)),
+				default=Value(0), output_field=IntegerField()
+			)),
+		)
+
+		count = 0
+		batch = []
+		for row in rows.iterator():
+			games, wins = row.pop("rollup_games"), row.pop("rollup_wins")
+			batch.append(self.model(games=games, wins=wins, **row))
+			if len(batch) >= batch_size:
+				self.bulk_create(batch)
+				count += len(batch)
+				batch = []
+		self.bulk_create(batch)
+		return count + len(batch)
+
+
+class WinRateRollup(models.Model):
+	"""
+	Precomputed number of games and wins of GlobalGamePlayers, grouped by
+	hero class, rank bracket, game type and ladder season.
+
+	Rows are updated as new games are processed (see record_game) and can
+	be rebuilt from history with the rebuild_win_rates command. Merging a
+	later upload into an existing game does not update them: players whose
+	final state or deck list is only completed by another upload of the
+	game are missing until the rollups are rebuilt.
+	"""
+	id = models.BigAutoField(primary_key=True)
+	player_class = IntEnumField(enum=CardClass, default=CardClass.INVALID)
+	rank_bracket = IntEnumField(enum=RankBracket, default=RankBracket.UNKNOWN)
+	game_type = IntEnumField(enum=BnetGameType, default=BnetGameType.BGT_UNKNOWN)
+	# 0 for games without a ladder season
+	ladder_season = models.IntegerField(default=0)
+
+	games = models.PositiveIntegerField(default=0)
+	wins = models.PositiveIntegerField(default=0)
+
+	objects = WinRateRollupManager()
+
+	class Meta:
+		abstract = True
+
+	@classmethod
+	def get_key(cls, global_game, player):
+		card = Card.objects.get_cached(player.hero_id)
+		return {
+			"player_class": card.card_class if card else CardClass.INVALID,
+			"rank_bracket": RankBracket.from_rank(player.rank),
+			"game_type": global_game.game_type or BnetGameType.BGT_UNKNOWN,
+			"ladder_season": global_game.ladder_season or 0,
+		}
+
+	@classmethod
+	def counts_player(cls, player):
+		"""
+		Whether a GlobalGamePlayer with a decided final state is counted.
+		"""
+		return True
+
+	@classmethod
+	def get_player_filter(cls):
+		"""
+		The condition of counts_player() as filter arguments on GlobalGamePlayer.
+		"""
+		return {}
+
+	@classmethod
+	def get_key_expressions(cls):
+		"""
+		The fields of get_key() as expressions on GlobalGamePlayer.
+		"""
+		return {
+			"player_class": F("hero__card_class"),
+			"rank_bracket": rank_bracket_expression(),
+			"game_type": Coalesce("game__game_type", Value(BnetGameType.BGT_UNKNOWN.value)),
+			"ladder_season": Coalesce("game__ladder_season", Value(0)),
+		}
+
+	@property
+	def win_rate(self):
+		return float(self.wins) / self.games if self.games else None
+
+
+class ClassWinRate(WinRateRollup):
+	class Meta:
+		unique_together = ("player_class", "rank_bracket", "game_type", "ladder_season")
+
+
+class DeckWinRate(WinRateRollup):
+	"""
+	Win rates of complete deck lists. Partial deck lists (eg. the cards an
+	opponent revealed) would each get rows of their own.
+	"""
+	deck = models.ForeignKey(Deck, on_delete=models.CASCADE)
+
+	class Meta:
+		unique_together = ("deck", "player_class", "rank_bracket", "game_type", "ladder_season")
+
+	@classmethod
+	def counts_player(cls, player):
+		return player.deck_list_complete
+
+	@classmethod
+	def get_player_filter(cls):
+		return {"deck_list_complete": True}
+
+	@classmethod
+	def get_key(cls, global_game, player):
+		key = super(DeckWinRate, cls).get_key(global_game, player)
+		key["deck_id"] = player.deck_list_id
+		return key
+
+	@classmethod
+	def get_key_expressions(cls):
+		expressions = super(DeckWinRate, cls).get_key_expressions()
+		expressions["deck_id"] = F("deck_list_id")
+		return expressions
+
+
+class CardPlayStats(models.Model):
+	"""
+	Append-only facts about the cards of a game: one row per card of each
+	player's starting deck, extracted from the game tree as the game is
+	processed (see extract_card_play_stats).
+
+	Card draw, play and win rates are aggregates over this table.
+	"""
+	id = models.BigAutoField(primary_key=True)
+	game = models.ForeignKey(GlobalGame, on_delete=models.CASCADE, related_name="card_stats")
+	player_id = PlayerIDField()
+	card = models.ForeignKey(Card, on_delete=models.PROTECT)
+
+	drawn = models.BooleanField(
+		default=False, help_text="Whether the card was drawn or kept in the opening hand."
+	)
+	mulliganed = models.BooleanField(default=False)
+	turn_played = models.PositiveSmallIntegerField(
+		null=True, blank=True, help_text="Game turn the card was first played on."
+	)
+	won = models.BooleanField(default=False, help_text="Whether the card's player won.")
+
+	@property
+	def played(self):
+		return self.turn_played is not None
@@ -6,4 +6,5 @@ class Command(BaseCommand):
 	help = "Requeue all raw logs in S3 to be processed."
 
 	def handle(self, *args, **options):
-		queue_raw_uploads_for_processing()
+		count = queue_raw_uploads_for_processing()
+		self.stdout.write("Queued %i raw uploads" % (count))
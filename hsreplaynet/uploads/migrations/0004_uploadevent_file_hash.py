@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-17 11:46
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('uploads', '0003_uploadevent_api_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadevent',
+            name='file_hash',
+            field=models.CharField(blank=True, db_index=True, help_text='SHA-256 hex digest of the uploaded file', max_length=64, verbose_name='File hash'),
+        ),
+    ]
@@ -8,7 +8,7 @@ from django.dispatch.dispatcher import receiver
 from django.utils.timezone import now
 from django.urls import reverse
 from hsreplaynet.utils.fields import IntEnumField, ShortUUIDField
-from hsreplaynet.utils import aws
+from hsreplaynet.utils import aws, get_file_hash
 
 
 class UploadEventType(IntEnum):
@@ -143,25 +143,30 @@ class RawUpload(object):
 		self._error_key = failed_error_key
 		self._state = RawUploadState.FAILED
 
-	def delete(self):
-
+	def delete(self, keep_log=False):
+		"""
+		Deletes the raw upload's objects from S3.
+		If keep_log is True, the log itself is left in place (eg. because
+		an UploadEvent now references it) and only the other objects are
+		deleted, which also prevents it from being requeued.
+		"""
 		if self.state == RawUploadState.NEW:
-			aws.S3.delete_objects(
-				Bucket=self.bucket,
-				Delete={
-					"Objects": [{"Key": self.log_key}, {"Key": self.descriptor_key}]
-				}
-			)
+			keys = [self.log_key, self.descriptor_key]
 		elif self.state == RawUploadState.FAILED:
-			aws.S3.delete_objects(
-				Bucket=self.bucket,
-				Delete={
-					"Objects": [{"Key": self.log_key}, {"Key": self.descriptor_key}, {"Key": self.error_key}]
-				}
-			)
+			keys = [self.log_key, self.descriptor_key, self.error_key]
 		else:
 			raise NotImplementedError("Delete is not supported for state: %s" % self.state.name)
 
+		if keep_log:
+			keys.remove(self.log_key)
+
+		aws.S3.delete_objects(
+			Bucket=self.bucket,
+			Delete={
+				"Objects": [{"Key": key} for key in keys]
+			}
+		)
+
 	@staticmethod
 	def from_s3_event(event):
 		bucket = event["bucket"]["name"]
@@ -275,6 +280,10 @@ class UploadEvent(models.Model):
 
 	metadata = models.TextField()
 	file = models.FileField(upload_to=_generate_upload_path)
+	file_hash = models.CharField(
+		"File hash", max_length=64, blank=True, db_index=True,
+		help_text="SHA-256 hex digest of the uploaded file"
+	)
 
 	def __str__(self):
 		return self.shortid
@@ -286,6 +295,15 @@ class UploadEvent(models.Model):
 	def get_absolute_url(self):
 		return reverse("upload_detail", kwargs={"shortid": self.shortid})
 
+	def save(self, *args, **kwargs):
+		if self.file and not self.file._committed and not self.file_hash:
+			# Hash files as they are stored. Files referenced by key
+			# (eg. raw uploads) are hashed when they are processed.
+			self.file.seek(0)
+			self.file_hash = get_file_hash(self.file)
+			self.file.seek(0)
+		super(UploadEvent, self).save(*args, **kwargs)
+
 	def process(self):
 		from hsreplaynet.games.processing import process_upload_event
 
@@ -295,5 +313,9 @@ class UploadEvent(models.Model):
 @receiver(models.signals.post_delete, sender=UploadEvent)
 def cleanup_uploaded_log_file(sender, instance, **kwargs):
 	file = instance.file
-	if file.name and default_storage.exists(file.name):
+	if not file.name or UploadEvent.objects.filter(file=file.name).exists():
+		# Raw logs referenced in place may be shared by several events,
+		# eg. if a raw upload was processed twice.
+		return
+	if default_storage.exists(file.name):
 		file.delete(save=False)
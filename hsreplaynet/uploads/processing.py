@@ -6,6 +6,10 @@ http://boto3.readthedocs.io/en/latest/reference/services/sns.html#SNS.Client.pub
 """
 import logging
 import os
+import string
+import time
+from functools import partial
+from multiprocessing.pool import ThreadPool
 from django.conf import settings
 from django.utils.timezone import now
 from hsreplaynet.uploads.models import UploadEvent, RawUpload
@@ -15,6 +19,19 @@ from hsreplaynet.utils import aws
 logger = logging.getLogger(__file__)
 
 
+# S3 prefixes are listed and SNS messages published in parallel
+REQUEUE_LIST_WORKERS = 8
+REQUEUE_PUBLISH_WORKERS = 32
+REQUEUE_PUBLISH_BATCH_SIZE = 500
+REQUEUE_PROGRESS_INTERVAL = 5000
+
+# Raw uploads are listed one hour at a time (raw/YYYY/MM/DD/HH/)
+RAW_UPLOAD_PARTITION_DEPTH = 4
+# Failed uploads are keyed by shortid (failed/<shortid>/...), we list them
+# by the first character of the shortid.
+FAILED_UPLOAD_PARTITIONS = string.ascii_letters + string.digits + "_"
+
+
 def queue_raw_uploads_for_processing():
 	"""
 	Queue all raw logs to attempt processing them into UploadEvents.
@@ -27,23 +44,21 @@ def queue_raw_uploads_for_processing():
 
 	This method is not intended to requeue uploads that have previously failed. For that see the
 	requeue_failed_* family of methods.
+
+	Returns the number of queued uploads.
 	"""
 
 	logger.info("Starting - Queue all raw uploads for processing")
 
-	topic_arn = aws.get_sns_topic_arn_from_name(settings.SNS_PROCESS_RAW_LOG_UPOAD_TOPIC)
-
-	if topic_arn is None:
-		raise Exception("A Topic for queueing raw uploads is not configured.")
-
-	for object in aws.list_all_objects_in(settings.S3_RAW_LOG_UPLOAD_BUCKET, prefix="raw"):
-		key = object["Key"]
-		if key.endswith("power.log"):  # Don't queue the descriptor files, just the logs.
-
-			raw_upload = RawUpload(settings.S3_RAW_LOG_UPLOAD_BUCKET, key)
-			logger.info("About to queue: %s" % str(raw_upload))
+	topic_arn = _get_raw_upload_topic_arn()
+	pool = ThreadPool(REQUEUE_LIST_WORKERS)
+	try:
+		partitions = _list_partitions(pool, "raw/", RAW_UPLOAD_PARTITION_DEPTH)
+	finally:
+		pool.terminate()
+	logger.info("Found %i partitions of raw uploads", len(partitions))
 
-			aws.publish_sns_message(topic_arn, raw_upload.sns_message)
+	return _requeue_raw_uploads(partitions, topic_arn)
 
 
 def check_for_failed_raw_upload_with_id(shortid):
@@ -56,11 +71,7 @@ def check_for_failed_raw_upload_with_id(shortid):
 		shortid - The shortid to check for an error.
 	"""
 	prefix = "failed/%s" % shortid
-	matching_uploads = _list_raw_uploads_by_prefix(prefix)
-	if len(matching_uploads) > 0:
-		return matching_uploads[0]
-	else:
-		return None
+	return next(_list_raw_uploads_by_prefix(prefix), None)
 
 
 def list_all_failed_raw_log_uploads():
@@ -69,10 +80,19 @@ def list_all_failed_raw_log_uploads():
 
 
 def _list_raw_uploads_by_prefix(prefix):
+	# Logs without a descriptor have already been turned into an UploadEvent
+	# which references them in place (see UPLOAD_RAW_LOGS_IN_PLACE).
+	# Descriptors are listed right before their log, as keys are sorted.
+	descriptor_keys = set()
 	for object in aws.list_all_objects_in(settings.S3_RAW_LOG_UPLOAD_BUCKET, prefix=prefix):
 		key = object["Key"]
-		if key.endswith("power.log"):  # Just emit one message per power.log
-			yield RawUpload(settings.S3_RAW_LOG_UPLOAD_BUCKET, key)
+		if key.endswith("descriptor.json"):
+			descriptor_keys.add(key)
+		elif key.endswith("power.log"):  # Just emit one message per power.log
+			raw_upload = RawUpload(settings.S3_RAW_LOG_UPLOAD_BUCKET, key)
+			if raw_upload.descriptor_key in descriptor_keys:
+				descriptor_keys.remove(raw_upload.descriptor_key)
+				yield raw_upload
 
 
 def requeue_failed_raw_uploads_all():
@@ -97,30 +117,116 @@ def requeue_failed_raw_logs_uploaded_after(cutoff):
 	Args:
 	    cutoff - Will requeue failed uploads more recent than this datetime
 	"""
-	prefix = "failed"
-	for raw_upload in _list_raw_uploads_by_prefix(prefix):
-		if raw_upload.timestamp >= cutoff:
-			_publish_requeue_message_for_failed_raw_log(raw_upload)
+	return _requeue_failed_raw_uploads_by_prefix(
+		"failed", predicate=lambda raw_upload: raw_upload.timestamp >= cutoff
+	)
 
 
-def _requeue_failed_raw_uploads_by_prefix(prefix):
+def _requeue_failed_raw_uploads_by_prefix(prefix, predicate=None):
 	"""
 	Requeue all failed raw logs to attempt processing them into UploadEvents.
 	"""
-	for raw_upload in _list_raw_uploads_by_prefix(prefix):
-		_publish_requeue_message_for_failed_raw_log(raw_upload)
+	topic_arn = _get_raw_upload_topic_arn()
+	if prefix == "failed":
+		partitions = ["failed/%s" % (c) for c in FAILED_UPLOAD_PARTITIONS]
+	else:
+		partitions = [prefix]
 
+	return _requeue_raw_uploads(partitions, topic_arn, predicate)
 
-def _publish_requeue_message_for_failed_raw_log(raw_upload):
 
+def _get_raw_upload_topic_arn():
 	topic_arn = aws.get_sns_topic_arn_from_name(settings.SNS_PROCESS_RAW_LOG_UPOAD_TOPIC)
 
 	if topic_arn is None:
 		raise Exception("A Topic for queueing raw uploads is not configured.")
 
+	return topic_arn
+
+
+def _list_partitions(pool, prefix, depth):
+	"""
+	Returns the S3 prefixes `depth` levels below `prefix`.
+	Each level is listed in parallel.
+	"""
+	list_prefixes = partial(aws.list_common_prefixes_in, settings.S3_RAW_LOG_UPLOAD_BUCKET)
+	prefixes = [prefix]
+	for i in range(depth):
+		prefixes = [p for children in pool.map(list_prefixes, prefixes) for p in children]
+	return sorted(prefixes)
+
+
+def _list_raw_uploads_in_partition(prefix):
+	return list(_list_raw_uploads_by_prefix(prefix))
+
+
+def _publish_raw_upload(topic_arn, raw_upload):
 	aws.publish_sns_message(topic_arn, raw_upload.sns_message)
 
 
+def _requeue_raw_uploads(partitions, topic_arn, predicate=None):
+	"""
+	Lists the raw uploads of every partition (an S3 prefix) in parallel and
+	publishes them to topic_arn through a bounded pool of threads.
+
+	Progress and rate are logged as messages are published.
+	Returns the number of published messages.
+	"""
+	list_pool = ThreadPool(REQUEUE_LIST_WORKERS)
+	publish_pool = ThreadPool(REQUEUE_PUBLISH_WORKERS)
+	publish = partial(_publish_raw_upload, topic_arn)
+	start = time.time()
+	published, last_report = 0, 0
+
+	try:
+		for raw_uploads in list_pool.imap_unordered(_list_raw_uploads_in_partition, partitions):
+			if predicate is not None:
+				raw_uploads = [raw_upload for raw_upload in raw_uploads if predicate(raw_upload)]
+
+			for i in range(0, len(raw_uploads), REQUEUE_PUBLISH_BATCH_SIZE):
+				batch = raw_uploads[i:i + REQUEUE_PUBLISH_BATCH_SIZE]
+				publish_pool.map(publish, batch)
+				published += len(batch)
+
+				if published - last_report >= REQUEUE_PROGRESS_INTERVAL:
+					last_report = published
+					rate = published / max(time.time() - start, 0.001)
+					logger.info("Published %i raw uploads (%.1f/s)", published, rate)
+	finally:
+		list_pool.terminate()
+		publish_pool.terminate()
+
+	duration = time.time() - start
+	logger.info(
+		"Published %i raw uploads from %i partitions in %.1fs",
+		published, len(partitions), duration
+	)
+	influx_metric("raw_uploads_requeued", {"value": published, "duration": duration})
+
+	return published
+
+
+def create_upload_event(data, token, api_key, upload_ip, file_key=None):
+	"""
+	Validates the metadata of an upload with UploadEventSerializer and
+	creates its UploadEvent. Authentication is up to the caller.
+
+	Used by both the API and the raw upload Lambdas. The Lambdas pass the
+	storage key of the log as file_key, which the API never accepts.
+	Raises a rest_framework ValidationError if the metadata is invalid.
+	"""
+	from hsreplaynet.api.serializers import UploadEventSerializer
+
+	serializer = UploadEventSerializer(data=data, context={
+		"token": token,
+		"api_key": api_key,
+		"upload_ip": upload_ip,
+		"file_key": file_key,
+	})
+	serializer.is_valid(raise_exception=True)
+	return serializer.save()
+
+
 def queue_upload_event_for_processing(upload_event_id):
 	"""
 	This method is used when UploadEvents are initially created.
@@ -143,7 +249,8 @@ def queue_upload_event_for_processing(upload_event_id):
 		success = True
 		try:
 			logger.info("Submitting %r to SNS", message)
-			response = aws.publish_sns_message(settings.SNS_PROCESS_UPLOAD_EVENT_TOPIC, message)
+			topic_arn = aws.get_sns_topic_arn(settings.SNS_PROCESS_UPLOAD_EVENT_TOPIC)
+			response = aws.publish_sns_message(topic_arn, message)
 			logger.info("SNS Response: %s" % str(response))
 		except Exception as e:
 			logger.error("Exception raised.")
@@ -0,0 +1,57 @@
+from django.conf import settings
+from django.core.files.storage import Storage
+from django.utils.deconstruct import deconstructible
+from storages.backends.s3boto3 import S3Boto3Storage
+
+
+# Keys of raw uploads, see RawUpload
+RAW_UPLOAD_PREFIXES = ("raw/", "failed/")
+
+
+@deconstructible
+class RawUploadS3Storage(Storage):
+	"""
+	S3 storage for AWS_STORAGE_BUCKET_NAME which also reads, serves and
+	deletes raw uploads ("raw/" and "failed/" keys) in place from
+	S3_RAW_LOG_UPLOAD_BUCKET.
+
+	This lets an UploadEvent reference its raw log without copying it
+	(see settings.UPLOAD_RAW_LOGS_IN_PLACE). Files saved anywhere else,
+	including UploadEvents created with a copy of their raw log, keep
+	going to the default bucket.
+	"""
+	def __init__(self):
+		self.default_storage = S3Boto3Storage()
+		self.raw_storage = S3Boto3Storage(bucket=settings.S3_RAW_LOG_UPLOAD_BUCKET)
+
+	def get_storage(self, name):
+		if name.startswith(RAW_UPLOAD_PREFIXES):
+			return self.raw_storage
+		return self.default_storage
+
+	def _open(self, name, mode="rb"):
+		return self.get_storage(name)._open(name, mode)
+
+	def _save(self, name, content):
+		return self.get_storage(name)._save(name, content)
+
+	def get_available_name(self, name, max_length=None):
+		return self.get_storage(name).get_available_name(name, max_length=max_length)
+
+	def delete(self, name):
+		return self.get_storage(name).delete(name)
+
+	def exists(self, name):
+		return self.get_storage(name).exists(name)
+
+	def listdir(self, path):
+		return self.get_storage(path).listdir(path)
+
+	def size(self, name):
+		return self.get_storage(name).size(name)
+
+	def modified_time(self, name):
+		return self.get_storage(name).modified_time(name)
+
+	def url(self, name):
+		return self.get_storage(name).url(name)
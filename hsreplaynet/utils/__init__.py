@@ -1,31 +1,55 @@
 import binascii
+import calendar
 import datetime
+import hashlib
 import logging
 import os
-import time
 from dateutil.relativedelta import relativedelta
 from uuid import UUID
 from django.http import Http404
 from django.shortcuts import get_object_or_404
 
 
-_timing_start = time.clock()
+try:
+	from time import perf_counter, process_time
+except ImportError:
+	# Python 2.7 (Lambda): time.clock() is the processor time on Unix
+	from time import time as perf_counter, clock as process_time
+
+
+_timing_start = perf_counter()
 logger = logging.getLogger(__file__)
 
+DEDUPLICATION_TIME_MARGIN = datetime.timedelta(hours=6)
+
 
 def _time_elapsed():
-	return (time.clock() - _timing_start) * 10000
+	"""
+	Returns the wall clock time elapsed since the last reset, in milliseconds.
+	"""
+	return (perf_counter() - _timing_start) * 1000
 
 
 def _reset_time_elapsed():
 	global _timing_start
-	_timing_start = time.clock()
+	_timing_start = perf_counter()
 
 
 def generate_key():
 	return binascii.hexlify(os.urandom(20)).decode()
 
 
+def get_file_hash(f, chunk_size=64 * 1024):
+	"""
+	Returns the SHA-256 hex digest of a binary file-like object,
+	reading it in chunks of `chunk_size` bytes from its current position.
+	"""
+	h = hashlib.sha256()
+	for chunk in iter(lambda: f.read(chunk_size), b""):
+		h.update(chunk)
+	return h.hexdigest()
+
+
 def get_client_ip(request):
 	"""
 	Get the IP of a client from the request
@@ -41,10 +65,28 @@ def deduplication_time_range(ts):
 	From a datetime, return a tuple of (datetime_min, datetime_max)
 	of the range margin around that datetime allowed for deduplication.
 	"""
-	margin = datetime.timedelta(hours=6)
+	margin = DEDUPLICATION_TIME_MARGIN
 	return ts - margin, ts + margin
 
 
+def deduplication_time_bucket(ts):
+	"""
+	From a datetime, return the index of the deduplication time bucket
+	it falls in. Buckets are twice as wide as the deduplication margin.
+	"""
+	width = DEDUPLICATION_TIME_MARGIN.total_seconds() * 2
+	return int(calendar.timegm(ts.utctimetuple()) // width)
+
+
+def deduplication_time_buckets(ts):
+	"""
+	From a datetime, return the sorted list of deduplication time buckets
+	covered by the range margin around that datetime (at most two).
+	"""
+	start, end = deduplication_time_range(ts)
+	return sorted(set(deduplication_time_bucket(t) for t in (start, ts, end)))
+
+
 def guess_ladder_season(timestamp):
 	epoch = datetime.datetime(2014, 1, 1, tzinfo=timestamp.tzinfo)
 	epoch_season = 1
@@ -1,4 +1,6 @@
 import json
+import threading
+import time
 from django.conf import settings
 
 try:
@@ -14,13 +16,59 @@ except ImportError:
 	IAM = None
 
 
+class SNSTopicRegistry(object):
+	"""
+	A per-process cache of SNS topic ARNs, by topic name.
+
+	All topics are listed (following NextToken) the first time a name is
+	looked up, then again whenever the cache is older than ttl seconds or
+	an unknown name is requested.
+	"""
+	def __init__(self, ttl=300):
+		self.ttl = ttl
+		self._topics = None
+		self._loaded_at = 0
+		self._lock = threading.Lock()
+
+	def _list_topics(self):
+		topics = {}
+		params = {}
+		while True:
+			response = SNS.list_topics(**params)
+			for topic in response["Topics"]:
+				arn = topic["TopicArn"]
+				topics[arn.split(":")[-1]] = arn
+			if not response.get("NextToken"):
+				return topics
+			params["NextToken"] = response["NextToken"]
+
+	def get_arn(self, name):
+		with self._lock:
+			expired = time.time() - self._loaded_at >= self.ttl
+			if self._topics is None or expired or name not in self._topics:
+				self._topics = self._list_topics()
+				self._loaded_at = time.time()
+			return self._topics.get(name)
+
+	def invalidate(self):
+		with self._lock:
+			self._topics = None
+
+
+sns_topics = SNSTopicRegistry()
+
+
 def get_sns_topic_arn_from_name(name):
-	response = SNS.list_topics()
-	topics = response["Topics"]
+	return sns_topics.get_arn(name)
+
 
-	for topic in response["Topics"]:
-		if topic["TopicArn"].split(":")[-1] == name:
-			return topic["TopicArn"]
+def get_sns_topic_arn(topic):
+	"""
+	Returns the ARN of a topic given either its ARN or its name.
+	"""
+	if topic and topic.startswith("arn:"):
+		return topic
+	return get_sns_topic_arn_from_name(topic)
 
 
 def enable_processing_raw_uploads():
@@ -72,19 +120,72 @@ def publish_sns_message(topic, message):
 	)
 
 
+def get_record_message(record):
+	"""
+	Returns the decoded JSON message carried by a Lambda event record.
+
+	Supports SNS records as well as SQS records, whether the queue is
+	subscribed to an SNS topic (the body is then an SNS envelope) or not.
+	"""
+	if "Sns" in record:
+		return json.loads(record["Sns"]["Message"])
+
+	body = json.loads(record["body"])
+	if "TopicArn" in body and "Message" in body:
+		return json.loads(body["Message"])
+	return body
+
+
+def get_s3_event_records(record):
+	"""
+	Returns the S3 event records carried by a Lambda event record.
+
+	S3 notifications are either delivered directly (a single S3 record) or
+	through SQS / SNS, in which case the message is a JSON document with its
+	own list of records. Test events sent by S3 carry no records.
+	"""
+	if "s3" in record:
+		return [record]
+	return get_record_message(record).get("Records", [])
+
+
+def get_record_id(record):
+	"""
+	Returns an identifier for a Lambda event record, suitable for
+	reporting partial batch failures.
+	"""
+	if "Sns" in record:
+		return record["Sns"]["MessageId"]
+	elif "s3" in record:
+		return record["s3"]["object"]["key"]
+	return record.get("messageId")
+
+
 def list_all_objects_in(bucket, prefix=None):
-	list_response = S3.list_objects_v2(
-		Bucket=bucket,
-		Prefix=prefix,
-	)
-	if list_response["KeyCount"] > 0:
-		objects = list_response["Contents"]
-		while objects:
-			yield objects.pop(0)
-			if list_response["IsTruncated"] and not objects:
-				list_response = S3.list_objects_v2(
-					Bucket=bucket,
-					Prefix=prefix,
-					ContinuationToken=list_response["NextContinuationToken"]
-				)
-				objects += list_response["Contents"]
+	params = {"Bucket": bucket}
+	if prefix is not None:
+		params["Prefix"] = prefix
+
+	while True:
+		list_response = S3.list_objects_v2(**params)
+		for object in list_response.get("Contents", []):
+			yield object
+		if not list_response["IsTruncated"]:
+			break
+		params["ContinuationToken"] = list_response["NextContinuationToken"]
+
+
+def list_common_prefixes_in(bucket, prefix, delimiter="/"):
+	"""
+	Returns the "directories" directly below prefix, eg. ["raw/2016/08/"]
+	for "raw/2016/". Prefix should end with the delimiter.
+	"""
+	params = {"Bucket": bucket, "Prefix": prefix, "Delimiter": delimiter}
+	prefixes = []
+	while True:
+		list_response = S3.list_objects_v2(**params)
+		prefixes += [p["Prefix"] for p in list_response.get("CommonPrefixes", [])]
+		if not list_response["IsTruncated"]:
+			break
+		params["ContinuationToken"] = list_response["NextContinuationToken"]
+	return prefixes
@@ -1,5 +1,7 @@
-import json
+import atexit
 import os
+import sys
+import threading
 import time
 import re
 from contextlib import contextmanager
@@ -8,7 +10,8 @@ from django.conf import settings
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.timezone import now
 from hsreplaynet.uploads.models import RawUpload
-from . import logger
+from hsreplaynet.utils.aws import get_record_message
+from . import logger, perf_counter, process_time
 
 
 if "raven.contrib.django.raven_compat" in settings.INSTALLED_APPS:
@@ -16,6 +19,18 @@ if "raven.contrib.django.raven_compat" in settings.INSTALLED_APPS:
 else:
 	sentry = None
 
+try:
+	import resource
+except ImportError:
+	# Not available on Windows
+	resource = None
+
+try:
+	import tracemalloc
+except ImportError:
+	# Python 2.7 (Lambda)
+	tracemalloc = None
+
 
 def error_handler(e):
 	if sentry is not None:
@@ -24,17 +39,61 @@ def error_handler(e):
 		logger.exception(e)
 
 
+def reset_peak_rss():
+	"""
+	Resets the peak resident set size of the current process (Linux only),
+	so that get_peak_rss() covers what happens from now on rather than the
+	whole life of the process (eg. every invocation of a Lambda container).
+	Returns whether the peak could be reset.
+	"""
+	try:
+		with open("/proc/self/clear_refs", "w") as f:
+			f.write("5")
+	except (IOError, OSError):
+		return False
+	return True
+
+
+def get_peak_rss():
+	"""
+	Returns the peak resident set size of the current process, in KB.
+	This is the peak since the last reset_peak_rss() where supported,
+	otherwise since the process started.
+	"""
+	try:
+		with open("/proc/self/status") as f:
+			for line in f:
+				if line.startswith("VmHWM:"):
+					return int(line.split()[1])
+	except (IOError, OSError):
+		pass
+
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == "darwin":
+		# ru_maxrss is in bytes on OS X
+		peak //= 1024
+	return peak
+
+
 def get_tracing_id(event):
 	"""
 	Returns the Authorization token as a unique identifier.
 	Used in the Lambda logging system to trace sessions.
 	"""
+	return get_record_tracing_id(event["Records"][0])
+
+
+def get_record_tracing_id(record):
+	"""
+	Returns the tracing identifier of a single record in a Lambda event.
+	"""
 	UNKNOWN_ID = "unknown-id"
-	event_data = event["Records"][0]
 
-	if "Sns" in event_data:
-		# We are in a lambda triggered via SNS
-		message = json.loads(event_data["Sns"]["Message"])
+	if "Sns" in record or "body" in record:
+		# We are in a lambda triggered via SNS (or an SQS queue)
+		message = get_record_message(record)
 
 		if "shortid" in message:
 			# We are in a lambda to process a raw s3 upload
@@ -45,9 +104,9 @@ def get_tracing_id(event):
 		else:
 			return UNKNOWN_ID
 
-	elif "s3" in event_data:
+	elif "s3" in record:
 		# We are in the process_s3_object Lambda
-		s3_event = event_data['s3']
+		s3_event = record["s3"]
 		raw_upload = RawUpload.from_s3_event(s3_event)
 		return raw_upload.shortid
 	else:
@@ -68,6 +127,7 @@ def lambda_handler(cpu_seconds=60, memory=128, name=None, handler=None):
 	The following standard lifecycle services are provided:
 		- Sentry reporting for all Exceptions that propagate
 		- Capturing a standard set of metrics for Influx
+		- Flushing all buffered Influx metrics
 		- Making sure all connections to the DB are closed
 		- Capturing metadata to facilicate deployment
 
@@ -117,6 +177,7 @@ def lambda_handler(cpu_seconds=60, memory=128, name=None, handler=None):
 					logger.info("Sentry is not available.")
 				raise
 			finally:
+				influx_sink.flush()
 				from django.db import connection
 				connection.close()
 
@@ -146,18 +207,87 @@ else:
 	influx = None
 
 
+class InfluxSink(object):
+	"""
+	A buffered sink for Influx points.
+
+	Points are kept in memory and written in a single request once either
+	max_points points are buffered or the oldest buffered point is older
+	than max_age seconds. The age is checked when points are added, and
+	by a daemon timer if timed_flush is set, so that quiet processes don't
+	hold on to their points. Whatever is left must be flushed explicitly
+	before the process exits or is frozen (see lambda_handler).
+
+	write_points is any callable taking a list of points, such as
+	InfluxDBClient.write_points or a local stand-in. If it is None,
+	points are discarded.
+	"""
+	def __init__(self, write_points, max_points=100, max_age=10, timed_flush=False):
+		self.write_points = write_points
+		self.max_points = max_points
+		self.max_age = max_age
+		self.timed_flush = timed_flush
+		self._points = []
+		self._oldest = None
+		self._timer = None
+		self._lock = threading.Lock()
+
+	@property
+	def enabled(self):
+		return self.write_points is not None
+
+	def add(self, point):
+		if not self.enabled:
+			return
+
+		with self._lock:
+			if not self._points:
+				self._oldest = time.time()
+				if self.timed_flush:
+					self._timer = threading.Timer(self.max_age, self.flush)
+					self._timer.daemon = True
+					self._timer.start()
+			self._points.append(point)
+			full = len(self._points) >= self.max_points
+			stale = time.time() - self._oldest >= self.max_age
+
+		if full or stale:
+			self.flush()
+
+	def flush(self):
+		with self._lock:
+			points, self._points = self._points, []
+			if self._timer is not None:
+				self._timer.cancel()
+				self._timer = None
+
+		if points:
+			try:
+				result = self.write_points(points)
+				if not result:
+					logger.warn("Influx Write Failure.")
+			except Exception as e:
+				# Can happen if Influx if not available for example
+				error_handler(e)
+
+
+influx_sink = InfluxSink(
+	influx.write_points if influx else None,
+	max_points=settings.INFLUX_BUFFER_MAX_POINTS,
+	max_age=settings.INFLUX_BUFFER_MAX_AGE,
+	# Lambda processes are frozen between invocations and flush on their own
+	timed_flush=not settings.ENV_LAMBDA,
+)
+atexit.register(influx_sink.flush)
+
+
 def influx_write_payload(payload):
-	try:
-		result = influx.write_points(payload)
-		if not result:
-			logger.warn("Influx Write Failure.")
-	except Exception as e:
-		# Can happen if Influx if not available for example
-		error_handler(e)
+	for point in payload:
+		influx_sink.add(point)
 
 
 def influx_metric(measure, fields, timestamp=None, **kwargs):
-	if influx is None:
+	if not influx_sink.enabled:
 		return
 
 	if timestamp is None:
@@ -175,10 +305,13 @@ def influx_metric(measure, fields, timestamp=None, **kwargs):
 @contextmanager
 def influx_timer(measure, timestamp=None, **kwargs):
 	"""
-	Reports the duration of the context manager.
+	Reports the duration of the context manager, in milliseconds.
+	The "value" field is the wall clock time and the "cpu_ms" field
+	is the processor time of the process during that span.
 	Additional kwargs are passed to InfluxDB as tags.
 	"""
-	start_time = time.clock()
+	wall_start = perf_counter()
+	cpu_start = process_time()
 	exception_raised = False
 	if timestamp is None:
 		timestamp = now()
@@ -188,19 +321,171 @@ def influx_timer(measure, timestamp=None, **kwargs):
 		exception_raised = True
 		raise
 	finally:
-		stop_time = time.clock()
-		duration = (stop_time - start_time) * 10000
+		wall_duration = (perf_counter() - wall_start) * 1000
+		cpu_duration = (process_time() - cpu_start) * 1000
 
 		tags = kwargs
 		tags["exception_thrown"] = exception_raised
 		payload = {
 			"fields": {
-				"value": duration,
+				"value": wall_duration,
+				"cpu_ms": cpu_duration,
 			},
 			"measurement": measure,
 			"tags": tags,
 			"time": timestamp.isoformat(),
 		}
 
-		if influx:
-			influx_write_payload([payload])
+		influx_write_payload([payload])
+
+
+class InfluxProfile(object):
+	"""
+	Profiles a unit of work (such as the processing of an upload) split
+	into named phases. Each phase records its wall clock and CPU time
+	and the bytes it read and wrote. With count_queries, the number of
+	DB queries it ran is recorded as well, by enabling query logging on
+	the connection for the duration of the profile.
+
+	All of it is reported as a single Influx point when the profile ends,
+	with one set of fields per phase (eg. "parse_ms", "parse_queries")
+	and the totals of the whole profile.
+
+	When tracemalloc is tracing (eg. in benchmarks), the peak memory
+	allocated during each phase is recorded as well.
+	"""
+	def __init__(self, measure, count_queries=False, **tags):
+		self.measure = measure
+		self.count_queries = count_queries
+		self.tags = tags
+		self.fields = {}
+		self._spans = []
+
+	@property
+	def current_span(self):
+		if self._spans:
+			return self._spans[-1]
+
+	def _query_count(self):
+		from django.db import connection
+		# The log is only appended to while the profile is active, so
+		# that queries logged before it (eg. by an enclosing
+		# CaptureQueriesContext) are kept and not counted.
+		return len(connection.queries_log) - self._queries_start
+
+	def _tracing_memory(self):
+		return tracemalloc is not None and tracemalloc.is_tracing()
+
+	def __enter__(self):
+		from django.db import connection
+		if self.count_queries:
+			# Query logging is only enabled by default in DEBUG mode
+			self._force_debug_cursor = connection.force_debug_cursor
+			connection.force_debug_cursor = True
+			self._queries_start = len(connection.queries_log)
+
+		_get_profile_stack().append(self)
+		self._peak_memory = 0
+		if self._tracing_memory():
+			tracemalloc.clear_traces()
+		self._timestamp = now()
+		self._wall_start = perf_counter()
+		self._cpu_start = process_time()
+		self._span_totals = {"bytes_read": 0, "bytes_written": 0}
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		from django.db import connection
+		self.fields["value"] = (perf_counter() - self._wall_start) * 1000
+		self.fields["cpu_ms"] = (process_time() - self._cpu_start) * 1000
+		if self.count_queries:
+			self.fields["queries"] = self._query_count()
+			connection.force_debug_cursor = self._force_debug_cursor
+		self.fields.update(self._span_totals)
+		if self._tracing_memory():
+			peak = tracemalloc.get_traced_memory()[1]
+			self.fields["peak_memory"] = max(self._peak_memory, peak)
+
+		_get_profile_stack().remove(self)
+
+		tags = self.tags
+		tags["exception_thrown"] = exc_type is not None
+		influx_write_payload([{
+			"measurement": self.measure,
+			"tags": tags,
+			"fields": self.fields,
+			"time": self._timestamp.isoformat(),
+		}])
+
+	@contextmanager
+	def phase(self, name):
+		span = {"bytes_read": 0, "bytes_written": 0}
+		self._spans.append(span)
+		wall_start = perf_counter()
+		cpu_start = process_time()
+		queries_start = self._query_count() if self.count_queries else 0
+		tracing_memory = self._tracing_memory()
+		if tracing_memory:
+			# Also resets the peak, which would otherwise span the whole profile
+			self._peak_memory = max(self._peak_memory, tracemalloc.get_traced_memory()[1])
+			tracemalloc.clear_traces()
+		try:
+			yield span
+		finally:
+			self._spans.pop()
+			fields = self.fields
+			fields[name + "_ms"] = (perf_counter() - wall_start) * 1000
+			fields[name + "_cpu_ms"] = (process_time() - cpu_start) * 1000
+			if self.count_queries:
+				fields[name + "_queries"] = self._query_count() - queries_start
+			if tracing_memory:
+				peak = tracemalloc.get_traced_memory()[1]
+				fields[name + "_peak_memory"] = peak
+				self._peak_memory = max(self._peak_memory, peak)
+			for key, value in span.items():
+				fields["%s_%s" % (name, key)] = value
+				self._span_totals[key] += value
+
+
+_active_profiles = threading.local()
+
+
+def _get_profile_stack():
+	if not hasattr(_active_profiles, "stack"):
+		_active_profiles.stack = []
+	return _active_profiles.stack
+
+
+def get_active_profile():
+	stack = _get_profile_stack()
+	if stack:
+		return stack[-1]
+
+
+@contextmanager
+def influx_phase(phase, **kwargs):
+	"""
+	Times a named phase of upload processing (eg. "parse", "validate"...).
+
+	Inside an active InfluxProfile, the phase is reported as part of the
+	profile. Otherwise all phases are reported under the same
+	measurement, tagged by phase.
+	"""
+	profile = get_active_profile()
+	if profile is not None:
+		with profile.phase(phase) as span:
+			yield span
+	else:
+		with influx_timer("upload_processing_phase_duration_ms", phase=phase, **kwargs):
+			yield {"bytes_read": 0, "bytes_written": 0}
+
+
+def record_io(bytes_read=0, bytes_written=0):
+	"""
+	Attributes I/O to the innermost phase of the active profile, if any.
+	"""
+	profile = get_active_profile()
+	if profile is not None and profile.current_span is not None:
+		span = profile.current_span
+		span["bytes_read"] += bytes_read
+		span["bytes_written"] += bytes_written
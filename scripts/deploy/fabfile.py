@@ -77,6 +77,7 @@ def _update_static_files(venv, path):
 
 def _update_database(venv, path):
 	sudo("%s/bin/python %s/manage.py migrate --noinput" % (venv, path), user="www-data")
+	sudo("%s/bin/python %s/manage.py createcachetable" % (venv, path), user="www-data")
 
 
 def _restart_web_server():
@@ -1,18 +1,39 @@
+import json
+from base64 import urlsafe_b64encode
+from datetime import timedelta
 import pytest
 from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
 from django.core.files.storage import default_storage
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now
 from rest_framework.serializers import ValidationError
-from hsreplaynet.api.serializers import SmartFileField
+from hsreplaynet.accounts.models import User
+from hsreplaynet.api.models import APIKey, AuthToken
+from hsreplaynet.games.models import GameReplay, GlobalGame
+from hsreplaynet.uploads.models import UploadEvent
+from hsreplaynet.uploads.processing import create_upload_event
 
 
-def test_smart_file_field():
-	field = SmartFileField()
+@pytest.mark.django_db
+def test_upload_event_file_key():
+	key = default_storage.save("test_file.txt", ContentFile("test data"))
+	data = {"type": 1, "build": 14366, "match_start": "2016-08-12T14:05:00Z"}
+
+	# Files in storage can't be referenced through the API
 	with pytest.raises(ValidationError):
-		field.run_validation("does_not_exist_12e89fhcu923rks.txt")
+		create_upload_event(dict(data, file=key), None, None, "127.0.0.1")
 
-	value = default_storage.save("test_file.txt", ContentFile("test data"))
-	field.run_validation(value)
-	default_storage.delete(value)
+	upload = create_upload_event(data, None, None, "127.0.0.1", file_key=key)
+	assert upload.file.name == key
+	other = create_upload_event(data, None, None, "127.0.0.1", file_key=key)
+
+	# The file is only deleted along with the last event referencing it
+	upload.delete()
+	assert default_storage.exists(key)
+	other.delete()
+	assert not default_storage.exists(key)
 
 
 @pytest.mark.django_db
@@ -49,3 +70,124 @@ def test_auth_token_request(client):
 	# POST without API key should error
 	response = client.post(url)
 	assert response.status_code == 403
+
+
+@pytest.mark.django_db
+def test_upload_event_create(client):
+	api_key = APIKey.objects.create(full_name="Test Client", email="test@example.org")
+	token = AuthToken.objects.create()
+	data = {
+		"file": SimpleUploadedFile("power.log", b"test data"),
+		"type": 1,
+		"build": 14366,
+		"match_start": "2016-08-12T14:05:00Z",
+	}
+	response = client.post(
+		"/api/v1/uploads/", data,
+		HTTP_X_API_KEY=str(api_key.api_key), HTTP_AUTHORIZATION="Token %s" % (token.key),
+		HTTP_X_FORWARDED_FOR="10.0.0.1",
+	)
+	assert response.status_code == 201
+
+	upload = UploadEvent.objects.get(shortid=response.json()["shortid"])
+	upload.file.open(mode="rb")
+	assert upload.file.read() == b"test data"
+	upload.file.close()
+	assert upload.token == token
+	assert upload.api_key == api_key
+	assert upload.upload_ip == "10.0.0.1"
+	assert json.loads(upload.metadata)["build"] == 14366
+
+	# Invalid metadata is rejected
+	del data["build"]
+	data["file"] = SimpleUploadedFile("power.log", b"test data")
+	response = client.post(
+		"/api/v1/uploads/", data,
+		HTTP_X_API_KEY=str(api_key.api_key), HTTP_AUTHORIZATION="Token %s" % (token.key),
+	)
+	assert response.status_code == 400
+	upload.delete()
+
+
+@pytest.mark.django_db
+def test_cached_auth_lookups():
+	user = User.objects.create(username="cached_auth_user")
+	token = AuthToken.objects.create(user=user)
+	api_key = APIKey.objects.create(full_name="Test Client", email="test@example.org")
+
+	assert AuthToken.objects.get_cached(token.key) == (token, True)
+	assert APIKey.objects.get_cached(api_key.api_key).enabled
+	with CaptureQueriesContext(connection) as ctx:
+		assert AuthToken.objects.get_cached(str(token.key)) == (token, True)
+		assert APIKey.objects.get_cached(str(api_key.api_key)) == api_key
+	assert len(ctx.captured_queries) == 0
+
+	user.is_active = False
+	user.save()
+	api_key.enabled = False
+	api_key.save()
+	assert AuthToken.objects.get_cached(token.key) == (token, False)
+	assert not APIKey.objects.get_cached(api_key.api_key).enabled
+
+	key = token.key
+	token.delete()
+	with pytest.raises(AuthToken.DoesNotExist):
+		AuthToken.objects.get_cached(key)
+
+
+@pytest.mark.django_db
+def test_cached_auth_user_save():
+	user = User.objects.create(username="cached_auth_user")
+	token = AuthToken.objects.create(user=user)
+	assert AuthToken.objects.get_cached(token.key) == (token, True)
+
+	# Saves which leave is_active alone don't look up the user's tokens
+	user.first_name = "Cached"
+	with CaptureQueriesContext(connection) as ctx:
+		user.save()
+	assert not any("api_authtoken" in q["sql"] for q in ctx.captured_queries)
+
+	user = User.objects.get(pk=user.pk)
+	user.is_active = False
+	user.save()
+	assert AuthToken.objects.get_cached(token.key) == (token, False)
+
+
+@pytest.mark.django_db
+def test_game_replay_list_cursor_pagination(client):
+	user = User.objects.create_user(username="staff", password="password", is_staff=True)
+	client.force_login(user, backend="django.contrib.auth.backends.ModelBackend")
+
+	start = now()
+	replays = []
+	for minutes in (0, 0, 5, 10, 10):
+		global_game = GlobalGame.objects.create(
+			match_start=start - timedelta(minutes=minutes),
+			match_end=start,
+			num_turns=10,
+			num_entities=100,
+		)
+		replays.append(GameReplay.objects.create(
+			global_game=global_game, user=user, friendly_player_id=1, client_handle=len(replays)
+		))
+	expected = [r.shortid for r in sorted(
+		replays, key=lambda r: (r.global_game.match_start, r.id), reverse=True
+	)]
+
+	pages, url = [], "/api/v1/games/?limit=2"
+	while url:
+		out = client.get(url).json()
+		pages.append([r["shortid"] for r in out["results"]])
+		url = out["next"]
+	assert pages == [expected[:2], expected[2:4], expected[4:]]
+
+	out = client.get(out["previous"]).json()
+	assert [r["shortid"] for r in out["results"]] == expected[2:4]
+	out = client.get(out["previous"]).json()
+	assert [r["shortid"] for r in out["results"]] == expected[:2]
+	assert out["previous"] is None
+
+	assert client.get("/api/v1/games/?cursor=invalid").status_code == 404
+	for position in (["x", 1], [start.isoformat(), "x"], [None, 1], [[], {}], [start.isoformat()]):
+		cursor = urlsafe_b64encode(json.dumps({"p": position}).encode("utf-8")).decode("ascii")
+		assert client.get("/api/v1/games/?cursor=" + cursor).status_code == 404
@@ -1,5 +1,8 @@
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from hearthstone import cardxml, enums
-from hsreplaynet.cards.models import Card
+from hsreplaynet.cards.models import Card, Deck, generate_digest_from_deck_list
 
 
 carddb = cardxml.load()[0]
@@ -43,3 +46,40 @@ def test_load_velens_chosen():
 	assert obj.card_class == enums.CardClass.PRIEST
 	assert obj.card_set == enums.CardSet.GVG
 	assert not obj.spell_damage
+
+
+@pytest.mark.django_db
+def test_get_or_create_deck_from_id_list():
+	id_list = ["NEW1_010", "OG_082", "OG_082", "GVG_010"]
+	for id in set(id_list):
+		Card.from_cardxml(carddb[id], save=True)
+
+	with CaptureQueriesContext(connection) as context:
+		deck, created = Deck.objects.get_or_create_from_id_list(id_list)
+	assert created
+	# Lookup, deck insert and a single bulk insert of the includes
+	assert len([q for q in context.captured_queries if "SAVEPOINT" not in q["sql"]]) == 3
+
+	assert deck.digest == generate_digest_from_deck_list(id_list)
+	assert sorted(deck.card_id_list()) == sorted(id_list)
+	assert deck.size() == 4
+
+	same_deck, created = Deck.objects.get_or_create_from_id_list(list(reversed(id_list)))
+	assert not created
+	assert same_deck.id == deck.id
+
+
+@pytest.mark.django_db
+def test_card_cache():
+	card = Card.from_cardxml(carddb["HERO_08"], save=True)
+	Card.objects.invalidate_cache()
+
+	cached = Card.objects.get_cached("HERO_08")
+	assert cached.type == enums.CardType.HERO
+	assert cached.card_class == card.card_class
+	assert Card.objects.get_cached("does_not_exist") is None
+
+	# Lookups are served from memory until the cache is invalidated
+	with CaptureQueriesContext(connection) as context:
+		Card.objects.get_cached("HERO_08")
+	assert not context.captured_queries
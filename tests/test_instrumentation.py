@@ -0,0 +1,154 @@
+import os
+import time
+import pytest
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from hsreplaynet.accounts.models import User
+from hsreplaynet.utils import instrumentation
+
+
+class FakeInflux:
+	def __init__(self):
+		self.writes = []
+
+	def write_points(self, points):
+		self.writes.append(points)
+		return True
+
+
+def test_influx_sink_batches_points():
+	backend = FakeInflux()
+	sink = instrumentation.InfluxSink(backend.write_points, max_points=3, max_age=60)
+
+	for i in range(4):
+		sink.add({"measurement": "test", "fields": {"value": i}})
+	assert len(backend.writes) == 1
+	assert len(backend.writes[0]) == 3
+
+	sink.flush()
+	assert len(backend.writes) == 2
+	assert backend.writes[1][0]["fields"]["value"] == 3
+
+	# Flushing an empty sink doesn't write anything
+	sink.flush()
+	assert len(backend.writes) == 2
+
+
+def test_influx_sink_timed_flush():
+	backend = FakeInflux()
+	sink = instrumentation.InfluxSink(backend.write_points, max_age=0.05, timed_flush=True)
+
+	# Points are written once they are old enough, even without further writes
+	sink.add({"measurement": "test", "fields": {"value": 1}})
+	time.sleep(0.3)
+	assert len(backend.writes) == 1
+
+	# Explicit flushes cancel the timer
+	sink.add({"measurement": "test", "fields": {"value": 2}})
+	sink.flush()
+	time.sleep(0.3)
+	assert len(backend.writes) == 2
+
+
+def test_influx_sink_disabled():
+	sink = instrumentation.InfluxSink(None)
+	assert not sink.enabled
+	sink.add({"measurement": "test", "fields": {"value": 1}})
+	sink.flush()
+
+
+def test_influx_metric_is_buffered(monkeypatch):
+	backend = FakeInflux()
+	sink = instrumentation.InfluxSink(backend.write_points, max_points=100, max_age=60)
+	monkeypatch.setattr(instrumentation, "influx_sink", sink)
+
+	instrumentation.influx_metric("test_metric", {"value": 1}, tag="a")
+	with instrumentation.influx_timer("test_timer"):
+		pass
+	assert not backend.writes
+
+	sink.flush()
+	measurements = [point["measurement"] for point in backend.writes[0]]
+	assert measurements == ["test_metric", "test_timer"]
+
+
+def test_influx_timer_measures_wall_time(monkeypatch):
+	backend = FakeInflux()
+	sink = instrumentation.InfluxSink(backend.write_points)
+	monkeypatch.setattr(instrumentation, "influx_sink", sink)
+
+	with instrumentation.influx_phase("parse"):
+		time.sleep(0.05)
+	sink.flush()
+
+	point = backend.writes[0][0]
+	assert point["measurement"] == "upload_processing_phase_duration_ms"
+	assert point["tags"]["phase"] == "parse"
+	# Sleeping takes wall time, but next to no CPU time
+	assert 50 <= point["fields"]["value"] < 1000
+	assert point["fields"]["cpu_ms"] < point["fields"]["value"]
+
+
+@pytest.mark.django_db
+def test_influx_profile(monkeypatch):
+	backend = FakeInflux()
+	sink = instrumentation.InfluxSink(backend.write_points)
+	monkeypatch.setattr(instrumentation, "influx_sink", sink)
+
+	with instrumentation.InfluxProfile("test_profile", count_queries=True, source="test"):
+		with instrumentation.influx_phase("parse"):
+			instrumentation.record_io(bytes_read=1000)
+		with instrumentation.influx_phase("db_commit"):
+			list(User.objects.all())
+			list(User.objects.all())
+			instrumentation.record_io(bytes_written=200)
+	sink.flush()
+
+	# A single point is reported for the whole profile
+	assert len(backend.writes[0]) == 1
+	point = backend.writes[0][0]
+	assert point["measurement"] == "test_profile"
+	assert point["tags"] == {"source": "test", "exception_thrown": False}
+
+	fields = point["fields"]
+	assert fields["parse_bytes_read"] == 1000
+	assert fields["parse_queries"] == 0
+	assert fields["db_commit_queries"] == 2
+	assert fields["db_commit_bytes_written"] == 200
+	assert fields["queries"] == 2
+	assert fields["bytes_read"] == 1000
+	assert fields["bytes_written"] == 200
+	assert fields["value"] >= fields["parse_ms"] + fields["db_commit_ms"]
+	assert instrumentation.get_active_profile() is None
+
+
+@pytest.mark.django_db
+def test_influx_profile_queries(monkeypatch):
+	monkeypatch.setattr(instrumentation, "influx_write_payload", lambda payload: None)
+
+	with CaptureQueriesContext(connection) as ctx:
+		list(User.objects.all())
+		with instrumentation.InfluxProfile("test_profile", count_queries=True) as profile:
+			list(User.objects.all())
+		assert connection.force_debug_cursor
+	# Queries captured around the profile are kept
+	assert len(ctx.captured_queries) == 2
+	assert profile.fields["queries"] == 1
+	assert not connection.force_debug_cursor
+
+	# Queries are only logged when they are counted
+	with instrumentation.InfluxProfile("test_profile") as profile:
+		assert not connection.force_debug_cursor
+		list(User.objects.all())
+	assert "queries" not in profile.fields
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/clear_refs"), reason="Linux only")
+def test_peak_rss_reset():
+	data = bytearray(64 * 1024 * 1024)
+	del data
+	peak = instrumentation.get_peak_rss()
+
+	if not instrumentation.reset_peak_rss():
+		pytest.skip("/proc/self/clear_refs is not writable")
+	assert instrumentation.get_peak_rss() < peak - 32 * 1024
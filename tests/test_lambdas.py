@@ -1,7 +1,15 @@
 import json
+import pytest
 import shortuuid
 from datetime import datetime
 from unittest.mock import MagicMock
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from rest_framework.exceptions import NotAuthenticated, PermissionDenied
+from hsreplaynet.api.models import APIKey, AuthToken
+from hsreplaynet.lambdas import uploads
+from hsreplaynet.lambdas.uploads import authenticate_raw_upload, create_upload_event_from_descriptor, process_records, process_s3_create_record
+from hsreplaynet.uploads.models import UploadEvent
 from hsreplaynet.utils import aws
 from isolated import uploaders
 
@@ -61,3 +69,118 @@ def test_process_s3_object(s3_create_object_event, upload_context, monkeypatch):
 
 	# Invoke code under test
 	# result = process_s3_object(s3_create_object_event, upload_context)
+
+
+def _s3_record(key):
+	return {"s3": {"bucket": {"name": "hsreplaynet-raw-log-uploads"}, "object": {"key": key}}}
+
+
+def test_process_s3_create_record_sqs(monkeypatch):
+	processed = []
+	monkeypatch.setattr(uploads, "process_raw_upload", processed.append)
+	keys = [
+		"raw/2016/07/20/10/37/hUHupxzE9GfBGoEE8ECQiN.power.log",
+		"raw/2016/07/20/10/38/6n4Gs3oLZ7HvNLyzd9WEoP.power.log",
+	]
+
+	# Notifications delivered straight from S3
+	process_s3_create_record(_s3_record(keys[0]))
+	assert [u.log_key for u in processed] == keys[:1]
+
+	# Notifications delivered through SQS carry their own list of records
+	del processed[:]
+	record = {
+		"eventSource": "aws:sqs",
+		"messageId": "m0",
+		"body": json.dumps({"Records": [_s3_record(key) for key in keys]}),
+	}
+	process_s3_create_record(record)
+	assert [u.log_key for u in processed] == keys
+
+	# S3 test events have no records
+	del processed[:]
+	record["body"] = json.dumps({"Service": "Amazon S3", "Event": "s3:TestEvent"})
+	process_s3_create_record(record)
+	assert processed == []
+
+
+def _sqs_record(message_id, message):
+	return {
+		"eventSource": "aws:sqs",
+		"messageId": message_id,
+		"body": json.dumps({"TopicArn": "arn:aws:sns:us-east-1:0:topic", "Message": json.dumps(message)}),
+	}
+
+
+def test_process_records_batch(monkeypatch):
+	processed = []
+
+	def process_record(record):
+		message = aws.get_record_message(record)
+		if message["id"] == 1:
+			raise ValueError("Bad record")
+		processed.append(message["id"])
+
+	event = {"Records": [_sqs_record("m%i" % (i), {"id": i}) for i in range(3)]}
+	result = process_records(event, process_record)
+
+	# The failure of one record does not prevent the others from being processed
+	assert processed == [0, 2]
+	assert result == {"batchItemFailures": [{"itemIdentifier": "m1"}]}
+
+
+def test_process_records_sns_reraises():
+	processed = []
+
+	def process_record(record):
+		message = aws.get_record_message(record)
+		if message["id"] == 0:
+			raise ValueError("Bad record")
+		processed.append(message["id"])
+
+	event = {"Records": [
+		{"Sns": {"MessageId": str(i), "Message": json.dumps({"id": i})}} for i in range(2)
+	]}
+	with pytest.raises(ValueError):
+		process_records(event, process_record)
+	assert processed == [1]
+
+
+@pytest.mark.django_db
+def test_authenticate_raw_upload():
+	api_key = APIKey.objects.create(full_name="Test Client", email="test@example.org")
+	token = AuthToken.objects.create()
+	headers = {"Authorization": "Token %s" % (token.key), "X-Api-Key": str(api_key.api_key)}
+
+	assert authenticate_raw_upload(headers) == (token, api_key)
+
+	with pytest.raises(NotAuthenticated):
+		authenticate_raw_upload(dict(headers, Authorization=str(token.key)))
+
+	api_key.enabled = False
+	api_key.save()
+	with pytest.raises(PermissionDenied):
+		authenticate_raw_upload(headers)
+
+
+@pytest.mark.django_db
+def test_create_upload_event_from_descriptor(monkeypatch):
+	queued = []
+	monkeypatch.setattr(uploads, "queue_upload_event_for_processing", queued.append)
+	api_key = APIKey.objects.create(full_name="Test Client", email="test@example.org")
+	token = AuthToken.objects.create()
+	key = default_storage.save("test_raw_upload.power.log", ContentFile("test data"))
+	descriptor = {
+		"gateway_headers": {"Authorization": "Token %s" % (token.key), "X-Api-Key": str(api_key.api_key)},
+		"source_ip": "10.0.0.1",
+	}
+	metadata = {"type": 1, "build": 14366, "match_start": "2016-08-12T14:05:00Z"}
+
+	result = create_upload_event_from_descriptor(descriptor, metadata, key)
+	assert result["result_type"] == "SUCCESS"
+	upload = UploadEvent.objects.get(id=json.loads(result["body"])["id"])
+	# The log is referenced by key rather than through the API file field
+	assert upload.file.name == key
+	assert upload.token == token
+	assert queued == [upload.id]
+	upload.delete()
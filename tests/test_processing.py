@@ -0,0 +1,408 @@
+import json
+import pytest
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from django.core.files.base import ContentFile
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils.timezone import now, utc
+from hearthstone import cardxml, entities
+from hearthstone.enums import BlockType, CardType, GameTag, PlayState, Step, Zone
+from hsreplaynet.cards.models import Card, Deck
+from hsreplaynet.games import processing
+from hsreplaynet.games.models import GameReplay, GlobalGame, GlobalGameDedupKey, GlobalGamePlayer
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+from hsreplaynet.utils import instrumentation
+
+
+carddb = cardxml.load()[0]
+
+
+def create_global_game():
+	return GlobalGame.objects.create(
+		game_handle=1234,
+		build=14366,
+		match_start=now(),
+		match_end=now(),
+		num_turns=10,
+		num_entities=100,
+	)
+
+
+class FakePacket(object):
+	def __init__(self, **kwargs):
+		self.packets = []
+		self.__dict__.update(kwargs)
+
+
+# Stand-ins for the hslog packets of a game tree
+packets = SimpleNamespace(**{
+	name: type(name, (FakePacket, ), {})
+	for name in ("Block", "TagChange", "FullEntity", "ShowEntity", "ChangeEntity")
+})
+
+GAME_CARD_IDS = ("HERO_01", "HERO_08", "CS2_106", "CS2_108", "EX1_400", "CS2_189")
+
+UPLOAD_META = {
+	"build": 14366,
+	"game_type": 2,
+	"game_handle": 1234,
+	"client_handle": 1,
+	"server_ip": "10.0.0.1",
+	"server_port": 3724,
+	"friendly_player": 1,
+}
+
+
+def build_game_tree(start_time):
+	"""
+	A short game won by player 1. Player 1 keeps CS2_106, mulligans CS2_108
+	and plays CS2_106 on turn 1, player 2 draws CS2_189 on turn 2.
+	Entity 10 is a card of player 2 which was never revealed.
+	"""
+	game = entities.Game(1)
+	game.create({GameTag.TURN: 3, GameTag.STEP: Step.MAIN_ACTION})
+	for entity_id, player_id, play_state in ((2, 1, PlayState.WON), (3, 2, PlayState.LOST)):
+		player = entities.Player(entity_id, player_id, 144115198130930503, player_id, "Player%i" % (player_id))
+		player.tags = {GameTag.PLAYSTATE: play_state, GameTag.FIRST_PLAYER: int(player_id == 1)}
+		game.register_entity(player)
+	for entity_id, card_id, controller, card_type in (
+		(4, "HERO_01", 1, CardType.HERO),
+		(5, "HERO_08", 2, CardType.HERO),
+		(6, "CS2_106", 1, CardType.WEAPON),
+		(7, "CS2_108", 1, CardType.SPELL),
+		(8, "EX1_400", 1, CardType.SPELL),
+		(9, "CS2_189", 2, CardType.MINION),
+		(10, None, 2, CardType.INVALID),
+	):
+		card = entities.Card(entity_id, card_id)
+		card.tags = {
+			GameTag.CARDTYPE: card_type,
+			GameTag.CONTROLLER: controller,
+			GameTag.ZONE: Zone.PLAY if card_type == CardType.HERO else Zone.DECK,
+		}
+		game.register_entity(card)
+
+	TagChange = packets.TagChange
+	return SimpleNamespace(
+		game=game,
+		start_time=start_time,
+		end_time=start_time + timedelta(minutes=10),
+		packets=[
+			TagChange(entity=1, tag=GameTag.STEP, value=Step.BEGIN_MULLIGAN),
+			TagChange(entity=6, tag=GameTag.ZONE, value=Zone.HAND),
+			TagChange(entity=7, tag=GameTag.ZONE, value=Zone.HAND),
+			TagChange(entity=7, tag=GameTag.ZONE, value=Zone.DECK),
+			TagChange(entity=1, tag=GameTag.STEP, value=Step.MAIN_READY),
+			TagChange(entity=1, tag=GameTag.TURN, value=1),
+			packets.Block(entity=6, type=BlockType.PLAY, packets=[
+				TagChange(entity=6, tag=GameTag.ZONE, value=Zone.PLAY),
+			]),
+			TagChange(entity=1, tag=GameTag.TURN, value=2),
+			packets.Block(entity=game.players[1], type=BlockType.TRIGGER, packets=[
+				packets.ShowEntity(entity=9, tags=[(GameTag.ZONE, Zone.HAND)]),
+			]),
+			TagChange(entity=1, tag=GameTag.TURN, value=3),
+			packets.Block(entity=6, type=BlockType.PLAY),
+		],
+	)
+
+
+@pytest.fixture
+def upload_processing(monkeypatch):
+	"""
+	Processes uploads of game trees with do_process_upload_event(), with
+	the log parsing and the replay XML storage stubbed out.
+	"""
+	for card_id in GAME_CARD_IDS:
+		Card.from_cardxml(carddb[card_id], save=True)
+	Card.objects.invalidate_cache()
+	monkeypatch.setattr(processing, "hslog", SimpleNamespace(packets=packets))
+
+	xml_writes = []
+
+	def save_hsreplay_xml(replay, parser, meta):
+		xml_writes.append(connection.in_atomic_block)
+		replay.replay_xml.name = "replays/%s.hsreplay.xml" % (replay.shortid)
+		return ContentFile(b"<HSReplay />")
+
+	monkeypatch.setattr(GameReplay, "save_hsreplay_xml", save_hsreplay_xml)
+
+	def process(game_tree, **meta):
+		monkeypatch.setattr(
+			processing, "parse_upload_event",
+			lambda upload_event, meta: SimpleNamespace(games=[game_tree])
+		)
+		meta = dict(UPLOAD_META, match_start=game_tree.start_time.isoformat(), **meta)
+		upload_event = UploadEvent.objects.create(
+			type=UploadEventType.POWER_LOG,
+			upload_ip="127.0.0.1",
+			metadata=json.dumps(meta),
+			file=ContentFile(json.dumps(meta).encode("utf-8"), name="power.log"),
+		)
+		return processing.do_process_upload_event(upload_event)
+
+	yield SimpleNamespace(process=process, xml_writes=xml_writes)
+	Card.objects.invalidate_cache()
+
+
+def fake_game_tree(start_time):
+	return SimpleNamespace(
+		start_time=start_time,
+		end_time=start_time + timedelta(minutes=10),
+		game=SimpleNamespace(entities=[], tags={GameTag.TURN: 10}),
+	)
+
+
+@pytest.mark.django_db
+def test_find_or_create_global_game_dedup():
+	meta = {
+		"game_handle": 1234, "client_handle": 1, "build": 14366, "game_type": 2,
+		"server_ip": "10.0.0.1", "server_port": 3724,
+	}
+	# Start of a deduplication time bucket
+	start_time = datetime(2016, 9, 1, 0, 0, tzinfo=utc)
+	global_game, unified = processing.find_or_create_global_game(fake_game_tree(start_time), meta)
+	assert not unified
+	assert global_game.dedup_keys.filter(game_handle=1234).exists()
+
+	found, unified = processing.find_or_create_global_game(
+		fake_game_tree(start_time + timedelta(minutes=1)), dict(meta, client_handle=2)
+	)
+	assert unified
+	assert found == global_game
+
+	# Games of another type are not unified
+	other, unified = processing.find_or_create_global_game(
+		fake_game_tree(start_time), dict(meta, game_type=7)
+	)
+	assert not unified
+	assert other != global_game
+
+	# Same time bucket, but out of the deduplication range: the key is taken
+	later_time = start_time + timedelta(hours=11)
+	later, unified = processing.find_or_create_global_game(fake_game_tree(later_time), meta)
+	assert not unified
+	assert later != global_game
+	assert not GlobalGameDedupKey.objects.filter(global_game=later).exists()
+
+	# The game without a key is still found by the other side
+	found, unified = processing.find_or_create_global_game(
+		fake_game_tree(later_time), dict(meta, client_handle=2)
+	)
+	assert unified
+	assert found == later
+
+
+def test_atomic_with_commit_phase(transactional_db, monkeypatch):
+	profile = instrumentation.InfluxProfile("test_profile", count_queries=True)
+	monkeypatch.setattr(instrumentation, "influx_write_payload", lambda payload: None)
+
+	with profile:
+		with processing.atomic_with_commit_phase("db_commit"):
+			create_global_game()
+			transaction.on_commit(lambda: list(GlobalGame.objects.all()))
+	# The callbacks run on commit are part of the phase, the body is not
+	assert profile.fields["db_commit_queries"] == 1
+	assert GlobalGame.objects.count() == 1
+
+	with pytest.raises(ValueError):
+		with processing.atomic_with_commit_phase("db_commit"):
+			create_global_game()
+			raise ValueError()
+	assert GlobalGame.objects.count() == 1
+
+
+def test_replay_xml_written_outside_transaction(transactional_db, upload_processing):
+	replay = upload_processing.process(build_game_tree(now()))
+	# The game and its dedup key were committed before the XML was written
+	assert upload_processing.xml_writes == [False]
+	assert GlobalGameDedupKey.objects.filter(global_game=replay.global_game).exists()
+	assert replay.global_game.players.count() == 2
+
+
+@pytest.mark.django_db
+def test_upload_processing_queries(upload_processing, monkeypatch):
+	monkeypatch.setattr(instrumentation, "influx_write_payload", lambda payload: None)
+	game_tree = build_game_tree(now())
+
+	def process(**meta):
+		with instrumentation.InfluxProfile("test_profile", count_queries=True) as profile:
+			replay = upload_processing.process(game_tree, **meta)
+		fields = profile.fields
+		return replay, (fields["dedup_queries"], fields["players_queries"])
+
+	# A new game: the key lookup, then the game and its key in a savepoint.
+	# The players are created in one query, each new deck in five
+	# (lookup, savepoint, deck, includes, release).
+	replay, queries = process()
+	assert queries == (5, 1 + 5 * 2)
+
+	# Another upload of the same game by the same player:
+	# the key and replay lookups, then the existing players.
+	duplicate, queries = process()
+	assert duplicate == replay
+	assert queries == (2, 1)
+
+	# The upload of the other player
+	other, queries = process(client_handle=2, friendly_player=2)
+	assert other != replay
+	assert other.global_game == replay.global_game
+	assert queries == (2, 1)
+
+
+@pytest.mark.django_db
+def test_extract_card_play_stats(upload_processing):
+	replay = upload_processing.process(build_game_tree(now()))
+	stats = {
+		(s.player_id, s.card_id): (s.drawn, s.mulliganed, s.turn_played, s.won)
+		for s in replay.global_game.card_stats.all()
+	}
+	# The unrevealed card of player 2 is skipped
+	assert stats == {
+		(1, "CS2_106"): (True, False, 1, True),
+		(1, "CS2_108"): (False, True, None, True),
+		(1, "EX1_400"): (False, False, None, True),
+		(2, "CS2_189"): (True, False, None, False),
+	}
+
+	# Other uploads of the game don't record them again
+	upload_processing.process(build_game_tree(replay.global_game.match_start), client_handle=2)
+	assert replay.global_game.card_stats.count() == 4
+
+
+@pytest.mark.django_db
+def test_deck_list_complete(upload_processing):
+	replay = upload_processing.process(build_game_tree(now()))
+	players = replay.global_game.players.order_by("player_id")
+	assert [p.deck_list_complete for p in players] == [False, False]
+
+	# A later upload with player 1's deck list in its metadata completes it
+	decklist = ["CS2_106"] * 30
+	upload_processing.process(
+		build_game_tree(replay.global_game.match_start),
+		client_handle=2, friendly_player=2, player1={"deck": decklist},
+	)
+	players = replay.global_game.players.order_by("player_id")
+	assert [p.deck_list_complete for p in players] == [True, False]
+	assert players[0].deck_list.card_id_list() == decklist
+
+
+@pytest.mark.django_db
+def test_find_or_create_global_game_concurrent(monkeypatch):
+	# A bucket boundary
+	boundary = datetime(2016, 9, 1, 12, 0, tzinfo=utc)
+	meta = {"game_handle": 1234, "client_handle": 1, "build": 14366, "game_type": 2}
+	global_game, unified = processing.find_or_create_global_game(
+		fake_game_tree(boundary - timedelta(minutes=1)), meta
+	)
+	assert not unified
+	# Keys are held for both buckets of the deduplication range
+	assert global_game.dedup_keys.count() == 2
+	assert global_game.dedup_keys.filter(server_address="0.0.0.0", server_port=0).count() == 2
+
+	# The other side of the game, uploaded concurrently, doesn't see the game
+	# yet. Its start falls in the next bucket and the servers are unknown,
+	# but its key still conflicts with the game's.
+	lookup = processing.find_global_game_by_dedup_key
+	lookups = []
+
+	def concurrent_lookup(*args):
+		lookups.append(args)
+		return lookup(*args) if len(lookups) > 1 else None
+
+	monkeypatch.setattr(processing, "find_global_game_by_dedup_key", concurrent_lookup)
+	found, unified = processing.find_or_create_global_game(
+		fake_game_tree(boundary + timedelta(minutes=1)), dict(meta, client_handle=2)
+	)
+	assert unified
+	assert found == global_game
+	assert len(lookups) == 2
+
+
+@pytest.mark.django_db
+def test_find_or_create_replay_queries():
+	global_game = create_global_game()
+	meta = {"friendly_player": 1, "client_handle": 2, "build": 14366}
+
+	with CaptureQueriesContext(connection) as ctx:
+		replay, duplicate = processing.find_or_create_replay(global_game, meta, True)
+	assert not duplicate
+	assert len(ctx.captured_queries) == 1
+
+	replay.save()
+
+	with CaptureQueriesContext(connection) as ctx:
+		found, duplicate = processing.find_or_create_replay(global_game, meta, True)
+	assert duplicate
+	assert found == replay
+	assert len(ctx.captured_queries) == 1
+
+	GameReplay.objects.create(global_game=global_game, friendly_player_id=1, client_handle=2)
+	with pytest.raises(RuntimeError):
+		processing.find_or_create_replay(global_game, meta, True)
+
+
+@pytest.mark.django_db
+def test_update_players_single_query():
+	for card_id in ("HERO_01", "HERO_02", "CS2_106", "CS2_101"):
+		Card.from_cardxml(carddb[card_id], save=True)
+	global_game = create_global_game()
+	empty_deck, _ = Deck.objects.get_or_create_from_id_list([])
+	deck, _ = Deck.objects.get_or_create_from_id_list(["CS2_106", "CS2_106", "CS2_101"])
+	player1 = GlobalGamePlayer.objects.create(
+		game=global_game, player_id=1, hero_id="HERO_01", deck_list=empty_deck, is_first=True
+	)
+	player2 = GlobalGamePlayer.objects.create(
+		game=global_game, player_id=2, hero_id="HERO_02", deck_list=empty_deck, is_first=False
+	)
+
+	player1.rank = 5
+	player1.final_state = PlayState.WON
+	player1.deck_list = deck
+	player2.real_name = "Player 2"
+	with CaptureQueriesContext(connection) as ctx:
+		processing.update_players({
+			player1: ["rank", "final_state", "deck_list"],
+			player2: ["real_name"],
+		})
+	assert len(ctx.captured_queries) == 1
+
+	player1 = GlobalGamePlayer.objects.get(id=player1.id)
+	assert (player1.rank, player1.final_state, player1.deck_list, player1.real_name) == (
+		5, PlayState.WON, deck, ""
+	)
+	player2 = GlobalGamePlayer.objects.get(id=player2.id)
+	assert (player2.rank, player2.final_state, player2.deck_list, player2.real_name) == (
+		None, PlayState.INVALID, empty_deck, "Player 2"
+	)
+
+
+@pytest.mark.django_db
+def test_find_replay_by_file_hash():
+	global_game = create_global_game()
+	replay = GameReplay.objects.create(global_game=global_game, friendly_player_id=1, client_handle=1)
+	original = UploadEvent.objects.create(
+		type=UploadEventType.POWER_LOG,
+		upload_ip="127.0.0.1",
+		file=ContentFile(b"GameState.DebugPrintPower()", name="power.log"),
+		status=UploadEventStatus.SUCCESS,
+		game=replay,
+	)
+	upload = UploadEvent(type=UploadEventType.POWER_LOG, upload_ip="127.0.0.1")
+	upload.file = ContentFile(b"GameState.DebugPrintPower()", name="power.log")
+	upload.save()
+	assert upload.file_hash == original.file_hash
+	assert processing.find_replay_by_file_hash(upload) == replay
+
+	upload.file_hash = ""
+	assert processing.find_replay_by_file_hash(upload) == replay
+	assert upload.file_hash == original.file_hash
+	assert upload.file.closed
+
+	original.status = UploadEventStatus.SERVER_ERROR
+	original.save()
+	assert processing.find_replay_by_file_hash(upload) is None
+
+	for event in (original, upload):
+		event.delete()
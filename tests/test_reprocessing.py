@@ -0,0 +1,42 @@
+from hearthstone.enums import GameTag, PlayState
+from hsreplay.utils import ElementTree
+from hsreplaynet.games.reprocessing import summarize_replay_xml
+
+
+REPLAY_XML = """<HSReplay version="1.3">
+<Game ts="2016-08-12T13:05:00">
+	<GameEntity id="1"><Tag tag="%(turn)i" value="1" /></GameEntity>
+	<Player id="2" playerID="1" accountHi="144115193835963207" accountLo="1" name="Player One#1234" rank="5">
+		<Tag tag="%(playstate)i" value="1" />
+		<Deck><Card id="CS2_106" /><Card id="CS2_106" /></Deck>
+	</Player>
+	<Player id="3" playerID="2" accountHi="0" accountLo="0" name="The Innkeeper">
+		<Tag tag="%(playstate)i" value="1" />
+	</Player>
+	<FullEntity id="4" cardID="HERO_01" />
+	<Block entity="1" type="5" ts="2016-08-12T13:10:00">
+		<TagChange entity="1" tag="%(turn)i" value="12" />
+		<TagChange entity="2" tag="%(playstate)i" value="%(won)i" />
+		<TagChange entity="3" tag="%(playstate)i" value="%(lost)i" />
+	</Block>
+</Game>
+</HSReplay>""" % {
+	"turn": GameTag.TURN, "playstate": GameTag.PLAYSTATE,
+	"won": PlayState.WON, "lost": PlayState.LOST,
+}
+
+
+def test_summarize_replay_xml():
+	game = ElementTree.fromstring(REPLAY_XML).find("Game")
+	summary = summarize_replay_xml(game)
+
+	assert summary.num_turns == 12
+	assert summary.num_entities == 4
+	player1, player2 = summary.players[1], summary.players[2]
+	assert player1.final_state == PlayState.WON
+	assert player1.rank == 5
+	assert player1.deck == ["CS2_106", "CS2_106"]
+	assert not player1.is_ai
+	assert player2.final_state == PlayState.LOST
+	assert player2.rank is None
+	assert player2.is_ai
@@ -0,0 +1,97 @@
+import pytest
+from django.utils.timezone import now
+from hearthstone import cardxml
+from hearthstone.enums import BnetGameType, CardClass, PlayState
+from hsreplaynet.cards.models import Card, Deck
+from hsreplaynet.games.models import GlobalGame, GlobalGamePlayer
+from hsreplaynet.stats.models import ClassWinRate, DeckWinRate, RankBracket, rank_bracket_expression
+
+
+carddb = cardxml.load()[0]
+
+
+def test_rank_bracket():
+	assert RankBracket.from_rank(None) == RankBracket.UNKNOWN
+	assert RankBracket.from_rank(0) == RankBracket.LEGEND
+	assert RankBracket.from_rank(1) == RankBracket.RANKS_1_5
+	assert RankBracket.from_rank(5) == RankBracket.RANKS_1_5
+	assert RankBracket.from_rank(6) == RankBracket.RANKS_6_10
+	assert RankBracket.from_rank(25) == RankBracket.RANKS_21_25
+	assert RankBracket.from_rank(26) == RankBracket.UNKNOWN
+	assert RankBracket.from_rank(-1) == RankBracket.UNKNOWN
+
+
+def create_game(deck, ranks, winner):
+	global_game = GlobalGame.objects.create(
+		game_type=BnetGameType.BGT_RANKED_STANDARD,
+		ladder_season=30,
+		match_start=now(),
+		match_end=now(),
+		num_turns=10,
+		num_entities=100,
+	)
+	players = []
+	for player_id, hero_id in ((1, "HERO_01"), (2, "HERO_02")):
+		players.append(GlobalGamePlayer.objects.create(
+			game=global_game,
+			player_id=player_id,
+			hero_id=hero_id,
+			deck_list=deck,
+			is_first=player_id == 1,
+			rank=ranks[player_id - 1],
+			final_state=PlayState.WON if player_id == winner else PlayState.LOST,
+			# Only the opponent's revealed cards are known
+			deck_list_complete=player_id == 1,
+		))
+	return global_game, players
+
+
+def get_rows(model):
+	return sorted(model.objects.values_list("player_class", "rank_bracket", "games", "wins"))
+
+
+@pytest.mark.django_db
+def test_win_rate_rollups():
+	for card_id in ("HERO_01", "HERO_02"):
+		Card.from_cardxml(carddb[card_id], save=True)
+	Card.objects.invalidate_cache()
+	deck, _ = Deck.objects.get_or_create_from_id_list([])
+
+	for ranks, winner in (((3, 4), 1), ((3, 0), 2), ((12, 12), 1)):
+		global_game, players = create_game(deck, ranks, winner)
+		ClassWinRate.objects.record_game(global_game, players)
+		DeckWinRate.objects.record_game(global_game, players)
+
+	expected = [
+		(CardClass.WARRIOR, RankBracket.RANKS_1_5, 2, 1),
+		(CardClass.WARRIOR, RankBracket.RANKS_11_15, 1, 1),
+		(CardClass.SHAMAN, RankBracket.LEGEND, 1, 1),
+		(CardClass.SHAMAN, RankBracket.RANKS_1_5, 1, 0),
+		(CardClass.SHAMAN, RankBracket.RANKS_11_15, 1, 0),
+	]
+	expected_decks = [row for row in expected if row[0] == CardClass.WARRIOR]
+	assert get_rows(ClassWinRate) == sorted(expected)
+	assert get_rows(DeckWinRate) == sorted(expected_decks)
+	assert set(DeckWinRate.objects.values_list("deck_id", flat=True)) == {deck.id}
+
+	for model, rows in ((ClassWinRate, expected), (DeckWinRate, expected_decks)):
+		model.objects.all().delete()
+		assert model.objects.rebuild(GlobalGamePlayer.objects.all()) == len(rows)
+		assert get_rows(model) == sorted(rows)
+
+
+@pytest.mark.django_db
+def test_rank_bracket_expression():
+	for card_id in ("HERO_01", "HERO_02"):
+		Card.from_cardxml(carddb[card_id], save=True)
+	deck, _ = Deck.objects.get_or_create_from_id_list([])
+	ranks = (None, -1, 0, 1, 5, 6, 25, 26)
+	for rank in ranks:
+		create_game(deck, (rank, None), winner=1)
+
+	players = GlobalGamePlayer.objects.filter(player_id=1).annotate(
+		bracket=rank_bracket_expression()
+	)
+	assert dict(players.values_list("rank", "bracket")) == {
+		rank: RankBracket.from_rank(rank) for rank in ranks
+	}
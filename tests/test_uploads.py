@@ -0,0 +1,144 @@
+import hashlib
+import pytest
+import shortuuid
+from django.core.files.base import ContentFile
+from hsreplaynet.uploads import processing
+from hsreplaynet.uploads.models import UploadEvent, UploadEventStatus, UploadEventType
+from hsreplaynet.utils import aws, get_file_hash
+
+
+class FakeS3(object):
+	"""A paginating stand-in for S3.list_objects_v2"""
+	def __init__(self, keys, page_size=2):
+		self.keys = sorted(keys)
+		self.page_size = page_size
+
+	def list_objects_v2(self, Bucket, Prefix="", Delimiter=None, ContinuationToken=None):
+		entries = []
+		for key in self.keys:
+			if not key.startswith(Prefix):
+				continue
+			if Delimiter and Delimiter in key[len(Prefix):]:
+				common_prefix = key[:key.index(Delimiter, len(Prefix)) + 1]
+				if ("prefix", common_prefix) not in entries:
+					entries.append(("prefix", common_prefix))
+			else:
+				entries.append(("key", key))
+
+		start = int(ContinuationToken or 0)
+		page = entries[start:start + self.page_size]
+		response = {
+			"KeyCount": len(page),
+			"Contents": [{"Key": value} for kind, value in page if kind == "key"],
+			"CommonPrefixes": [{"Prefix": value} for kind, value in page if kind == "prefix"],
+			"IsTruncated": start + self.page_size < len(entries),
+		}
+		if response["IsTruncated"]:
+			response["NextContinuationToken"] = str(start + self.page_size)
+		return response
+
+
+def test_list_all_objects_in(monkeypatch):
+	keys = ["a/%i" % (i) for i in range(7)] + ["b/1"]
+	monkeypatch.setattr(aws, "S3", FakeS3(keys))
+
+	assert [o["Key"] for o in aws.list_all_objects_in("bucket", prefix="a/")] == keys[:7]
+	assert aws.list_common_prefixes_in("bucket", "") == ["a/", "b/"]
+
+
+def test_queue_raw_uploads_for_processing(monkeypatch):
+	keys = []
+	for ts in ("2016/08/12/13/05", "2016/08/12/14/00", "2016/09/01/00/59"):
+		for i in range(3):
+			shortid = shortuuid.uuid()
+			keys.append("raw/%s/%s.power.log" % (ts, shortid))
+			keys.append("raw/%s/%s.descriptor.json" % (ts, shortid))
+	expected = [key for key in keys if key.endswith("power.log")]
+	# Already referenced by an UploadEvent (no descriptor left)
+	keys.append("raw/2016/08/12/13/05/%s.power.log" % (shortuuid.uuid()))
+
+	published = []
+	monkeypatch.setattr(aws, "S3", FakeS3(keys))
+	monkeypatch.setattr(aws, "get_sns_topic_arn_from_name", lambda name: "arn:topic")
+	monkeypatch.setattr(aws, "publish_sns_message", lambda topic, msg: published.append(msg))
+
+	assert processing.queue_raw_uploads_for_processing() == 9
+	assert sorted(msg["log_key"] for msg in published) == sorted(expected)
+
+
+def test_sns_topic_registry(monkeypatch):
+	pages = {
+		None: {"Topics": [{"TopicArn": "arn:aws:sns:us-east-1:1:first"}], "NextToken": "2"},
+		"2": {"Topics": [{"TopicArn": "arn:aws:sns:us-east-1:1:second"}]},
+	}
+	calls = []
+
+	class FakeSNS(object):
+		def list_topics(self, NextToken=None):
+			calls.append(NextToken)
+			return pages[NextToken]
+
+	monkeypatch.setattr(aws, "SNS", FakeSNS())
+	registry = aws.SNSTopicRegistry(ttl=300)
+
+	assert registry.get_arn("second") == "arn:aws:sns:us-east-1:1:second"
+	assert registry.get_arn("first") == "arn:aws:sns:us-east-1:1:first"
+	assert calls == [None, "2"]
+
+	registry.invalidate()
+	assert registry.get_arn("first") == "arn:aws:sns:us-east-1:1:first"
+	assert calls == [None, "2", None, "2"]
+
+
+@pytest.mark.django_db
+def test_bulk_ingest_skips_ingested_logs(tmpdir):
+	from hsreplaynet.games.management.commands import bulk_ingest_logs
+
+	tmpdir.mkdir("2016").join("a.log").write_binary(b"GameState.DebugPrintPower()")
+	tmpdir.join("b.txt").write_binary(b"Not a log")
+	paths = list(bulk_ingest_logs.find_logs([str(tmpdir)], "*.log"))
+	assert paths == [str(tmpdir.join("2016", "a.log"))]
+
+	with open(paths[0], "rb") as f:
+		file_hash = get_file_hash(f)
+	assert file_hash == hashlib.sha256(b"GameState.DebugPrintPower()").hexdigest()
+
+	UploadEvent.objects.create(
+		type=UploadEventType.POWER_LOG,
+		upload_ip="127.0.0.1",
+		status=UploadEventStatus.SUCCESS,
+		file_hash=file_hash,
+	)
+	assert bulk_ingest_logs.ingest_log((paths[0], False)) == (paths[0], "skipped", 27, None)
+
+
+@pytest.mark.django_db
+def test_bulk_ingest_file_name(tmpdir, monkeypatch):
+	from hsreplaynet.games.management.commands import bulk_ingest_logs
+
+	monkeypatch.setattr(UploadEvent, "process", lambda self: None)
+	path = str(tmpdir.join("a.log"))
+	tmpdir.join("a.log").write_binary(b"GameState.DebugPrintPower()")
+	for i in range(2):
+		assert bulk_ingest_logs.ingest_log((path, True)) == (path, "ingested", 27, None)
+
+	events = list(UploadEvent.objects.all())
+	assert len(events) == 2
+	for event in events:
+		# Each log is stored under its own event's shortid
+		assert len(event.shortid) == 22
+		assert event.file.name.endswith("/%s.power.log" % (event.shortid))
+		event.file.delete(save=False)
+
+
+@pytest.mark.django_db
+def test_upload_event_file_hash():
+	event = UploadEvent(type=UploadEventType.POWER_LOG, upload_ip="127.0.0.1")
+	event.file = ContentFile(b"GameState.DebugPrintPower()", name="power.log")
+	event.save()
+	assert event.file_hash == hashlib.sha256(b"GameState.DebugPrintPower()").hexdigest()
+
+	event.file.open(mode="rb")
+	assert event.file.read() == b"GameState.DebugPrintPower()"
+	event.file.close()
+	event.delete()
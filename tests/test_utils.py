@@ -0,0 +1,18 @@
+from datetime import datetime, timedelta
+from django.utils.timezone import utc
+from hsreplaynet.utils import DEDUPLICATION_TIME_MARGIN, deduplication_time_bucket, deduplication_time_buckets
+
+
+def test_deduplication_time_buckets():
+	ts = datetime(2016, 8, 1, 11, 58, tzinfo=utc)
+	buckets = deduplication_time_buckets(ts)
+	assert 1 <= len(buckets) <= 2
+	assert deduplication_time_bucket(ts) in buckets
+
+	# Any other timestamp within the margin has its bucket probed
+	for minutes in range(-6 * 60, 6 * 60 + 1, 7):
+		other = ts + timedelta(minutes=minutes)
+		assert deduplication_time_bucket(other) in buckets
+
+	other = ts + DEDUPLICATION_TIME_MARGIN * 3
+	assert deduplication_time_bucket(other) not in buckets